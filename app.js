@@ -1203,12 +1203,16 @@ showEmptyStarredState() {
                 this.updateUploadProgress(progressItem, 0, 0, file.size, 0, 'starting');
             });
             
-            xhr.addEventListener('load', () => {
+            xhr.addEventListener('load', async () => {
                 if (xhr.status === 200) {
                     try {
-                        this.updateUploadProgress(progressItem, 100, file.size, file.size, 0, 'completed');
+                        // The server queues the file for Telegram and answers with its job
+                        const job = JSON.parse(xhr.responseText);
+                        const upload = this.activeUploads.get(id);
+                        if (upload) upload.jobId = job.job_id;
                         
-                        const result = JSON.parse(xhr.responseText);
+                        const result = await this.waitForUploadJob(job, progressItem, file.size);
+                        this.updateUploadProgress(progressItem, 100, file.size, file.size, 0, 'completed');
                         console.log('Upload successful:', result.name);
                         
                         this.totalStorageUsed += file.size;
@@ -1220,9 +1224,11 @@ showEmptyStarredState() {
                         
                         resolve(result);
                     } catch (error) {
-                        console.error('Error parsing response:', error);
-                        this.updateUploadProgress(progressItem, 0, 0, file.size, 0, 'failed');
+                        console.error('Upload failed:', error.message);
+                        const cancelled = error.message === 'Upload cancelled';
+                        this.updateUploadProgress(progressItem, 0, 0, file.size, 0, cancelled ? 'cancelled' : 'failed');
                         this.activeUploads.delete(id);
+                        this.updateUploadStatusIndicator();
                         reject(error);
                     }
                 } else {
@@ -1256,6 +1262,30 @@ showEmptyStarredState() {
         });
     }
     
+    async waitForUploadJob(job, progressItem, fileSize) {
+        // Poll the upload job until the file has reached Telegram
+        while (job.status === 'queued' || job.status === 'running') {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            
+            const response = await this.makeAuthenticatedRequest(`${this.apiBase}/upload/jobs/${job.job_id}`);
+            if (!response.ok) {
+                throw new Error(`Upload job lookup failed: ${response.status}`);
+            }
+            job = await response.json();
+            
+            const sent = Math.min(job.bytes_sent || 0, fileSize);
+            this.updateUploadProgress(progressItem, fileSize ? (sent / fileSize) * 100 : 100, sent, fileSize, job.throughput, 'processing');
+        }
+        
+        if (job.status === 'cancelled') {
+            throw new Error('Upload cancelled');
+        }
+        if (job.status !== 'completed') {
+            throw new Error(job.error || `Upload ${job.status}`);
+        }
+        return job.result;
+    }
+    
     addUploadProgressItem(filename, fileSize, id) {
         const progressContainer = document.getElementById('uploadProgress');
         if (!progressContainer) return null;
@@ -1345,6 +1375,7 @@ showEmptyStarredState() {
             const statusMap = {
                 'starting': 'Starting...',
                 'uploading': clampedPercentage < 5 ? 'Connecting...' : 'Uploading...',
+                'processing': 'Sending to Telegram...',
                 'completed': '✅ Completed',
                 'failed': '❌ Failed',
                 'cancelled': '🚫 Cancelled'
@@ -1408,6 +1439,11 @@ showEmptyStarredState() {
             if (upload.progressItem?.xhr) {
                 upload.progressItem.xhr.abort();
             }
+            if (upload.jobId) {
+                // Already handed to the server; stop its job too
+                this.makeAuthenticatedRequest(`${this.apiBase}/upload/cancel/${upload.jobId}`, { method: 'POST' })
+                    .catch(error => console.error('Error cancelling upload job:', error));
+            }
             this.updateUploadProgress(upload.progressItem, 0, 0, upload.file.size, 0, 'cancelled');
         }
         
@@ -0,0 +1,83 @@
+# blob_store.py - Content-addressed on-disk storage for file bodies
+import os
+import mmap
+import hashlib
+import tempfile
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore:
+    """Stores file bodies under their SHA-256, e.g. blobs/ab/abcdef..."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def size(self, digest):
+        return os.path.getsize(self.path(digest))
+
+    def _commit(self, tmp_path, digest):
+        target = self.path(digest)
+        if os.path.exists(target):
+            # Same content is already stored
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+        return digest
+
+    def put_bytes(self, data):
+        """Store a bytes object and return its digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        if self.exists(digest):
+            return digest
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return self._commit(tmp_path, digest)
+
+    def put_stream(self, fileobj, chunk_size=CHUNK_SIZE):
+        """Copy a file object into the store, hashing as it goes
+
+        Returns (digest, size). Memory use is bounded by chunk_size.
+        """
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = fileobj.read(chunk_size)
+                    if not chunk:
+                        break
+                    sha.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return self._commit(tmp_path, sha.hexdigest()), size
+
+    def iter_chunks(self, digest, start=0, end=None, chunk_size=CHUNK_SIZE):
+        """Yield bytes [start, end) of a blob through a memory map"""
+        with open(self.path(digest), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            end = size if end is None else min(end, size)
+            if size == 0 or start >= end:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for offset in range(start, end, chunk_size):
+                    yield mm[offset:min(offset + chunk_size, end)]
+
+    def delete(self, digest):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
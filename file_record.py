@@ -0,0 +1,140 @@
+# file_record.py - Compact in-memory representation of file metadata
+import sys
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class _Unset:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "UNSET"
+
+
+# Marks a field the record does not have, as opposed to one set to None
+UNSET = _Unset()
+
+# JSON keys held in their own slot, in the order they are emitted
+FIELD_KEYS = (
+    "id", "name", "size", "mime_type", "folder_id", "uploaded_by", "created_at",
+    "is_deleted", "starred", "telegram_file_id", "telegram_group_id", "blob", "sha256",
+)
+
+# A few distinct values shared by many records
+INTERNED_KEYS = frozenset(("mime_type", "telegram_group_id"))
+
+
+def timestamp_us(value):
+    """ISO timestamp -> microseconds since the epoch, or None if it would not round-trip"""
+    if not isinstance(value, str):
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if moment.tzinfo is not None or moment.isoformat() != value:
+        return None
+    return (moment - _EPOCH) // _MICROSECOND
+
+
+def isoformat_us(value):
+    return (_EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+class FileRecord(MutableMapping):
+    """A file row in a fixed set of slots instead of a per-record dict
+
+    Behaves like the dict it replaces, so endpoints can keep reading and
+    mutating records with record["key"]; use to_dict() for the JSON shape.
+    created_at is held as microseconds since the epoch, MIME types are
+    interned, and rarely used keys (versions, *_at stamps) live in extra.
+    """
+
+    __slots__ = (
+        "id", "name", "size", "mime_type", "folder_id", "uploaded_by", "created_us",
+        "is_deleted", "starred", "telegram_file_id", "telegram_group_id", "blob", "sha256", "extra",
+    )
+
+    def __init__(self, data=None):
+        for slot in self.__slots__:
+            setattr(self, slot, UNSET)
+        self.extra = None
+        if data:
+            for key, value in data.items():
+                self[key] = value
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data)
+
+    def to_dict(self):
+        return {key: self[key] for key in self}
+
+    def copy(self):
+        return FileRecord(self)
+
+    def __getitem__(self, key):
+        if key == "created_at":
+            if self.created_us is not UNSET:
+                return isoformat_us(self.created_us)
+        elif key in FIELD_KEYS:
+            value = getattr(self, key)
+            if value is UNSET:
+                raise KeyError(key)
+            return value
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        if key == "created_at":
+            self.created_us = timestamp_us(value)
+            if self.created_us is not None:
+                if self.extra:
+                    self.extra.pop(key, None)
+                return
+            # Kept verbatim if the string would not survive the conversion
+            self.created_us = UNSET
+        elif key in FIELD_KEYS:
+            if key in INTERNED_KEYS and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, key, value)
+            return
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key == "created_at" and self.created_us is not UNSET:
+            self.created_us = UNSET
+        elif key in FIELD_KEYS and key != "created_at":
+            if getattr(self, key) is UNSET:
+                raise KeyError(key)
+            setattr(self, key, UNSET)
+        elif self.extra is not None and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in FIELD_KEYS:
+            slot = "created_us" if key == "created_at" else key
+            if getattr(self, slot) is not UNSET:
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"FileRecord({self.to_dict()!r})"
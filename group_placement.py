@@ -0,0 +1,100 @@
+# group_placement.py - Which storage channel an upload goes to
+import time
+from collections import deque
+
+STRATEGIES = ("fill", "hash", "folder")
+
+
+class GroupPlacement:
+    """Spreads uploads over the storage channels listed in tg_groups.json
+
+    "fill" sends each upload to the channel holding the fewest messages,
+    "hash" picks one by content hash, and "folder" keeps every folder in
+    the channel folder_groups maps it to (the default group if unmapped).
+    A folder mapped in folder_groups goes to its channel under any strategy.
+
+    A channel is full once it holds max_messages, or busy once it took
+    max_per_minute messages in the last minute. An upload for a busy channel
+    spills over to the least busy channel that is not full. Only when the
+    channel it should go to is full (under "folder") or every channel is
+    full does choose() return None, and a new channel should be created and
+    passed to assign().
+    """
+
+    def __init__(self, strategy, max_messages, max_per_minute):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown placement strategy {strategy!r}, expected one of {STRATEGIES}")
+        self.strategy = strategy
+        self.max_messages = max_messages
+        self.max_per_minute = max_per_minute
+        self.recent = {}  # group id -> times of messages sent to it in the last minute
+
+    def _last_minute(self, group_id):
+        times = self.recent.get(str(group_id))
+        if not times:
+            return 0
+        cutoff = time.time() - 60
+        while times and times[0] < cutoff:
+            times.popleft()
+        return len(times)
+
+    def full(self, group_id, message_count):
+        return message_count(group_id) >= self.max_messages
+
+    def busy(self, group_id):
+        return self._last_minute(group_id) >= self.max_per_minute
+
+    def groups(self, groups_data):
+        """Channels shared by unmapped folders under fill and hash"""
+        groups = [groups_data["default_group_id"]] if groups_data.get("default_group_id") else []
+        groups += [g for g in groups_data.get("storage_groups", []) if g not in groups]
+        return groups
+
+    def choose(self, groups_data, folder_id, digest, message_count):
+        """Channel for an upload of content digest into folder_id, or None
+
+        message_count(group_id) gives how many messages a channel holds.
+        """
+        mapped = groups_data.get("folder_groups", {}).get(str(folder_id))
+        if self.strategy == "folder":
+            target = mapped or groups_data.get("default_group_id")
+            if self.full(target, message_count):
+                return None
+        elif mapped and not self.full(mapped, message_count):
+            target = mapped
+        else:
+            candidates = [g for g in self.groups(groups_data) if not self.full(g, message_count)]
+            if not candidates:
+                return None
+            if self.strategy == "hash":
+                target = candidates[int(digest[:16], 16) % len(candidates)]
+            else:
+                target = min(candidates, key=message_count)
+
+        if self.busy(target):
+            return self.least_busy(groups_data, folder_id, message_count)
+        return target
+
+    def least_busy(self, groups_data, folder_id, message_count):
+        """The channel with the fewest recent messages, preferring those not full"""
+        groups = self.groups(groups_data)
+        mapped = groups_data.get("folder_groups", {}).get(str(folder_id))
+        if mapped and mapped not in groups:
+            groups.append(mapped)
+        open_groups = [g for g in groups if not self.full(g, message_count)]
+        return min(open_groups or groups, key=lambda g: (self._last_minute(g), message_count(g)))
+
+    def assign(self, groups_data, folder_id, group_id):
+        """Record a newly created channel; under "folder" it takes over the folder"""
+        groups_data.setdefault("storage_groups", []).append(group_id)
+        if self.strategy == "folder":
+            groups_data.setdefault("folder_groups", {})[str(folder_id)] = group_id
+
+    def sent(self, group_id, messages=1):
+        """Count messages sent to a channel against its rate"""
+        times = self.recent.setdefault(str(group_id), deque())
+        now = time.time()
+        times.extend([now] * messages)
+
+    def created(self, groups_data):
+        return len(groups_data.get("storage_groups", []))
@@ -1,7 +1,7 @@
 # main.py - Enhanced with Google Drive features
 from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Request, Header, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, Response
+from fastapi.responses import StreamingResponse, JSONResponse
 from datetime import datetime, timedelta
 import os
 import json
@@ -15,16 +15,26 @@ import io
 import re
 import unicodedata
 from dotenv import load_dotenv
-from telethon import TelegramClient
-from telethon.sessions import StringSession
-from telethon.tl.functions.channels import CreateChannelRequest, DeleteChannelRequest
+from telethon import utils
+from telethon.tl.functions.channels import CreateChannelRequest, DeleteChannelRequest, InviteToChannelRequest
 from telethon.tl.functions.messages import DeleteMessagesRequest
-from telethon.tl.types import InputPeerChannel, InputChannel
+from telethon.tl.types import InputPeerChannel, InputChannel, PeerChannel
 import jwt
 import shutil
 import tempfile
 import base64
+import uuid
 import json
+from metadata_store import MetadataStore, Migrations, storage_keys
+from blob_store import BlobStore
+from file_record import timestamp_us
+from telegram_transfer import upload_stream, segment_ranges, FileSlice, hash_file, iter_segments, SEGMENT_SIZE
+from upload_sessions import UploadSessions
+from upload_jobs import UploadJobs
+from telegram_pool import TelegramPool
+from rpc_scheduler import priority, BACKGROUND
+from group_placement import GroupPlacement
+from contextlib import asynccontextmanager
 
 load_dotenv()
 
@@ -50,16 +60,55 @@ API_HASH = os.getenv("API_HASH", "0ba2d1a1f16a2ac4d83427a0a63e2153")
 BOT_TOKEN = os.getenv("BOT_TOKEN", "8163786005:AAGXksXF-hMKLo3isJ2p57OL0GZvGsmCYpM")
 SESSION_STRING = os.getenv("SESSION_STRING", "1BVtsOJEBu2fHrJxQKE5knVbrqUwc2IH1IPU85cacoDFd5MIq-v3WCQIzC4JsUA427msEDhNHrJ17z5Z3GEZ3VfuiETmcgmHDm8jdqGA3ZLIdZSN73XPaH_FNlQASlin4_FoOEVzZVzNdSpM40M79C2isYei3tYE_r7I_Kx_60M3hSPAOxH4jJY0jrMAjgtXST3-iA-hfB2TKov9njoUGI_WrM7TClvYo6J-sWyUFTzqqms4ZnzqZYmZvLECWhDKqaIWhvaOAsg90xMrPAlByGfqLQmUjyw9ulrDHfqh1uvsjlemiFlgjMe7qF9JPZYzStRDC4IrN_7jeP8WtKc_Qhw9X7Tba1mk=")
 JWT_SECRET = os.getenv("JWT_SECRET", "my_super_secret_jwt_key_12345")
-
-# # Initialize Telegram client
-# client = TelegramClient(StringSession(SESSION_STRING), API_ID, API_HASH)
+TELEGRAM_READY_TIMEOUT = float(os.getenv("TELEGRAM_READY_TIMEOUT", "15"))  # seconds a request waits for the connection
+TELEGRAM_CONNECT_RETRY = int(os.getenv("TELEGRAM_CONNECT_RETRY", "5"))  # seconds before retrying a failed connect, doubling
+TELEGRAM_CONNECT_RETRY_MAX = int(os.getenv("TELEGRAM_CONNECT_RETRY_MAX", "300"))
+TELEGRAM_HEALTH_INTERVAL = int(os.getenv("TELEGRAM_HEALTH_INTERVAL", "30"))  # seconds between checks for dropped sessions
+TELEGRAM_UPLOAD_PARALLELISM = int(os.getenv("TELEGRAM_UPLOAD_PARALLELISM", "4"))  # connections per big upload
+TELEGRAM_PART_RETRIES = int(os.getenv("TELEGRAM_PART_RETRIES", "3"))
+TELEGRAM_SEGMENT_SIZE = min(int(os.getenv("TELEGRAM_SEGMENT_SIZE", str(SEGMENT_SIZE))), SEGMENT_SIZE)  # bytes per message
+TELEGRAM_SEGMENT_PARALLELISM = int(os.getenv("TELEGRAM_SEGMENT_PARALLELISM", "2"))  # segments moved at once per session
+TELEGRAM_DOWNLOAD_AHEAD = int(os.getenv("TELEGRAM_DOWNLOAD_AHEAD", "4"))  # 512KB parts buffered per download stream
+MAX_BYTE_RANGES = int(os.getenv("MAX_BYTE_RANGES", "16"))  # ranges honoured in one Range header
+# More accounts to spread transfers over; each must be a member of the storage groups
+TELEGRAM_EXTRA_SESSIONS = [s.strip() for s in os.getenv("TELEGRAM_EXTRA_SESSIONS", "").split(",") if s.strip()]
+TELEGRAM_BOT_TOKENS = [t.strip() for t in os.getenv("TELEGRAM_BOT_TOKENS", "").split(",") if t.strip()]
+TELEGRAM_SESSIONS = ([SESSION_STRING] if SESSION_STRING else []) + TELEGRAM_EXTRA_SESSIONS
+TELEGRAM_SESSION_COUNT = len(TELEGRAM_SESSIONS) + len(TELEGRAM_BOT_TOKENS)
+TELEGRAM_RPC_RATE = float(os.getenv("TELEGRAM_RPC_RATE", "30"))  # requests per second per session
+TELEGRAM_RPC_BURST = int(os.getenv("TELEGRAM_RPC_BURST", "60"))
+TELEGRAM_RPC_RESERVE = int(os.getenv("TELEGRAM_RPC_RESERVE", "10"))  # tokens background calls leave for interactive ones
+TELEGRAM_MAX_FLOOD_WAIT = int(os.getenv("TELEGRAM_MAX_FLOOD_WAIT", "300"))  # longer flood waits fail the call instead
 
 # Database files
-DB_FILE = "tgdrive_db.json"
+DB_FILE = "tgdrive_db.json"  # legacy whole-file database, imported once into DB_PATH
+DB_PATH = os.getenv("DB_PATH", "tgdrive.db")
+DB_FLUSH_INTERVAL = float(os.getenv("DB_FLUSH_INTERVAL", "2"))  # seconds between compaction checks
+DB_JOURNAL_COMPACT_BYTES = int(os.getenv("DB_JOURNAL_COMPACT_BYTES", str(4 * 1024 * 1024)))
+DB_JOURNAL_FSYNC = os.getenv("DB_JOURNAL_FSYNC", "false").lower() == "true"
+STORE_READY_TIMEOUT = float(os.getenv("STORE_READY_TIMEOUT", "15"))  # seconds a request waits for metadata to load
 GROUPS_FILE = "tg_groups.json"
+STORAGE_PLACEMENT = os.getenv("STORAGE_PLACEMENT", "fill")  # fill, hash or folder: how uploads pick a channel
+STORAGE_GROUP_MAX_MESSAGES = int(os.getenv("STORAGE_GROUP_MAX_MESSAGES", "100000"))  # a fuller channel takes no more
+STORAGE_GROUP_MAX_PER_MINUTE = int(os.getenv("STORAGE_GROUP_MAX_PER_MINUTE", "20"))  # messages before uploads spill over
+STORAGE_GROUP_LIMIT = int(os.getenv("STORAGE_GROUP_LIMIT", "20"))  # channels created automatically at most
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")  # resumable uploads staged here until finalized
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))  # idle seconds before a session expires
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # suggested PUT size for resumable uploads
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", "100"))  # uploads waiting for a worker before 503s
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", str(2 * max(1, TELEGRAM_SESSION_COUNT))))  # uploads sent to Telegram at once
+UPLOAD_JOB_TTL = int(os.getenv("UPLOAD_JOB_TTL", "3600"))  # seconds a finished job's status is kept
+UPLOAD_TELEGRAM_WAIT = int(os.getenv("UPLOAD_TELEGRAM_WAIT", "900"))  # seconds a job waits for a free session before failing
+BLOB_DIR = os.getenv("BLOB_DIR", "blobs")  # content-addressed file bodies
+SEARCH_RESULT_LIMIT = int(os.getenv("SEARCH_RESULT_LIMIT", "100"))
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+EXPORT_BATCH_SIZE = 500
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "200"))  # records per background step
+MIGRATION_INTERVAL = float(os.getenv("MIGRATION_INTERVAL", "0.5"))  # seconds between steps
 
-# Store active uploads
-active_uploads = {}
+# Bump this and register a @migrations.step() to change the stored record shape
+SCHEMA_VERSION = 2
 
 def sanitize_filename(filename):
     """Sanitize filename to avoid encoding issues"""
@@ -95,32 +144,212 @@ def safe_json_encode(obj):
     
     return clean_dict(obj)
 
-def load_db():
-    if os.path.exists(DB_FILE):
+# Metadata store (files, folders, users) - rows are cleaned on write and
+# upgraded to SCHEMA_VERSION the first time they are touched. It loads in
+# a startup task, so liveness answers while a large store is read in;
+# requests that need it wait on store_ready.
+migrations = Migrations(SCHEMA_VERSION)
+store = MetadataStore(
+    DB_PATH,
+    encode=safe_json_encode,
+    compact_bytes=DB_JOURNAL_COMPACT_BYTES,
+    journal_fsync=DB_JOURNAL_FSYNC,
+    migrations=migrations,
+    defer_load=True
+)
+store_ready = None
+store_task = None
+
+def import_legacy_db():
+    """Import tgdrive_db.json into the metadata store on first run"""
+    try:
+        store.import_json_db(DB_FILE)
+    except Exception as e:
+        print(f"Error importing legacy database: {e}")
+
+# Mutations are journaled immediately; the SQLite snapshot is compacted
+# in the background once the journal grows past DB_JOURNAL_COMPACT_BYTES
+flush_lock = asyncio.Lock()
+flush_task = None
+migration_task = None
+
+async def flush_db(force=False):
+    """Fold the journal into the snapshot, writing off the event loop"""
+    async with flush_lock:
+        if not store.is_dirty() and not store.journal_bytes:
+            return
+        if not force and not store.needs_compaction():
+            return
+        changes = store.begin_compaction()
         try:
-            with open(DB_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if 'users' not in data:
-                    data['users'] = []
-                if 'files' not in data:
-                    data['files'] = []
-                if 'folders' not in data:
-                    data['folders'] = []
-                if 'next_id' not in data:
-                    data['next_id'] = 1
-                return data
+            await asyncio.to_thread(store.write_changes, changes)
+            store.finish_compaction()
         except Exception as e:
-            print(f"Error loading database: {e}")
-    
-    return {"files": [], "folders": [], "users": [], "next_id": 1}
+            store.requeue(changes)
+            print(f"Error compacting database: {e}")
+
+async def flush_db_periodically():
+    while True:
+        await asyncio.sleep(DB_FLUSH_INTERVAL)
+        await flush_db()
 
-def save_db(data):
+async def migrate_in_background():
+    """Upgrade outdated records a batch at a time, so startup never waits on it"""
+    pending = store.pending_migrations()
+    if not pending:
+        return
+    print(f"Migrating {pending} records to schema version {SCHEMA_VERSION} in the background")
+    while store.pending_migrations():
+        await asyncio.to_thread(stage_inline_content, store.next_outdated(MIGRATION_BATCH_SIZE))
+        if not store.migrate_some(MIGRATION_BATCH_SIZE):
+            print(f"Background migration stopped with {store.pending_migrations()} records left")
+            return
+        await asyncio.sleep(MIGRATION_INTERVAL)
+    print("Background migration finished")
+
+async def load_store():
+    """Load the snapshot and journal off the event loop, then start the db tasks"""
+    global flush_task, migration_task
     try:
-        clean_data = safe_json_encode(data)
-        with open(DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump(clean_data, f, indent=2, ensure_ascii=False)
+        await asyncio.to_thread(store.load)
+        await asyncio.to_thread(import_legacy_db)
     except Exception as e:
-        print(f"Error saving database: {e}")
+        print(f"Error loading metadata: {e}")
+        store_ready.set_result(False)
+        return
+    print(f"Metadata loaded, {store.count_files()} files")
+    store_ready.set_result(True)
+    flush_task = asyncio.create_task(flush_db_periodically())
+    migration_task = asyncio.create_task(migrate_in_background())
+
+async def get_store(timeout=STORE_READY_TIMEOUT):
+    """The loaded store, waiting up to timeout for the startup load"""
+    if store_ready is None:
+        raise HTTPException(status_code=503, detail="Metadata is not loaded")
+    try:
+        loaded = await asyncio.wait_for(asyncio.shield(store_ready), timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Metadata is still loading", headers={"Retry-After": "5"})
+    if not loaded:
+        raise HTTPException(status_code=503, detail="Metadata failed to load")
+    return store
+
+def store_state():
+    if store_ready is None or not store_ready.done():
+        return "loading"
+    return "loaded" if store_ready.result() else "failed"
+
+@app.on_event("startup")
+async def start_db_tasks():
+    global store_ready, store_task
+    store_ready = asyncio.get_running_loop().create_future()
+    store_task = asyncio.create_task(load_store())
+
+@app.on_event("shutdown")
+async def stop_db_tasks():
+    tasks = [task for task in (store_task, flush_task, migration_task) if task]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # Compact on shutdown so the next start has nothing to replay
+    if store.loaded:
+        await flush_db(force=True)
+
+# File bodies stored locally live here, records only keep the "blob" digest
+blobs = BlobStore(BLOB_DIR)
+
+def decode_inline_content(file_record):
+    """Inline content is base64 (main.py uploads) or hex (Drive/main.py uploads)"""
+    content = file_record["content"]
+    try:
+        data = bytes.fromhex(content)
+        if len(data) == file_record.get("size", len(data)):
+            return data
+    except ValueError:
+        pass
+    return base64.b64decode(content)
+
+# Schema migrations, run per record by the store
+
+@migrations.step("files", 1)
+def add_file_flags(file_record):
+    file_record.setdefault("starred", False)
+    file_record.setdefault("is_deleted", False)
+
+# Blob digests of inline content written ahead by stage_inline_content(),
+# so the migration step itself does no I/O on the event loop
+staged_blobs = {}
+
+def stage_inline_content(records):
+    """Write the inline content of records about to be migrated into the blob store"""
+    for record in records:
+        if record.get("content"):
+            staged_blobs[record["id"]] = blobs.put_bytes(decode_inline_content(record))
+
+async def migrated_file(file_record):
+    """file_record with every migration applied, its blob written off the event loop"""
+    if file_record.get("content"):
+        await asyncio.to_thread(stage_inline_content, [file_record])
+    return store.migrate_file(file_record["id"]) or file_record
+
+# Not run on reads: the background migration stages the blobs in a thread first
+@migrations.step("files", 2, lazy=False)
+def move_inline_content_to_blobs(file_record):
+    if file_record.get("content"):
+        digest = staged_blobs.pop(file_record["id"], None)
+        file_record["blob"] = digest or blobs.put_bytes(decode_inline_content(file_record))
+    file_record.pop("content", None)
+
+# Files whose Telegram messages are being deleted; they can no longer be
+# copied or deduplicated onto
+purging_files = set()
+
+def get_live_file(file_id):
+    """Return a file record that is not in the bin, or None"""
+    file_record = store.get_file(file_id)
+    if file_record and not file_record.get("is_deleted", False) and file_id not in purging_files:
+        return file_record
+    return None
+
+# Keyset pagination: clients pass back next_cursor as ?after= to get the next page
+def encode_cursor(key):
+    raw = json.dumps(key, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def page_params(limit, after):
+    """Page size and the id to continue after"""
+    after_id = decode_cursor(after) if after else None
+    if after_id is not None and not isinstance(after_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return limit or DEFAULT_PAGE_SIZE, after_id
+
+def record_json(record):
+    """A store record -> the plain dict the API returns
+
+    Legacy inline content is left out, it is only read by downloads.
+    """
+    data = record.to_dict()
+    data.pop("content", None)
+    return data
+
+def file_json(records):
+    """Store records -> the plain dicts the API returns"""
+    return [record_json(record) for record in records]
+
+def keyset_page(records, limit, to_json=file_json):
+    """records were fetched with limit + 1, the extra one tells us there is a next page"""
+    has_more = len(records) > limit
+    records = records[:limit]
+    return {
+        "items": to_json(records),
+        "next_cursor": encode_cursor(records[-1]["id"]) if has_more else None
+    }
 
 def load_groups():
     if os.path.exists(GROUPS_FILE):
@@ -147,18 +376,40 @@ def format_file_size(bytes_size):
     i = int(math.floor(math.log(bytes_size) / math.log(k)))
     return f"{round(bytes_size / math.pow(k, i), 2)} {sizes[i]}"
 
+async def create_group(groups_data, title, about):
+    """Create a storage megagroup and add the pool's other sessions to it
+
+    Returns its id; the caller saves groups_data.
+    """
+    primary = telegram_pool.primary
+    if primary is None:
+        raise RuntimeError("creating a group needs a user session, not a bot")
+    result = await primary.client(CreateChannelRequest(title=title, about=about, megagroup=True))
+    channel = result.chats[0]
+    primary.peers[channel.id] = InputPeerChannel(channel.id, channel.access_hash)
+    # Keep the access hash so the group can be addressed without a dialog fetch
+    saved_access_hashes(groups_data, primary)[str(channel.id)] = channel.access_hash
+    
+    for session in telegram_pool.sessions:
+        if session is primary or session.state != "connected":
+            continue
+        try:
+            # Accounts are invited by username, the only handle valid across accounts
+            me = await session.client.get_me()
+            if not me.username:
+                raise ValueError("it has no username")
+            user = await primary.client.get_input_entity(me.username)
+            await primary.client(InviteToChannelRequest(InputChannel(channel.id, channel.access_hash), [user]))
+        except Exception as e:
+            print(f"Could not add Telegram session {session.name} to group {channel.id}: {e}")
+    return channel.id
+
 async def ensure_default_group():
     groups_data = load_groups()
     
     if not groups_data.get("default_group_id"):
         try:
-            result = await client(CreateChannelRequest(
-                title="TG Drive Storage",
-                about="Default storage for TG Drive files",
-                megagroup=True
-            ))
-            
-            group_id = result.chats[0].id
+            group_id = await create_group(groups_data, "TG Drive Storage", "Default storage for TG Drive files")
             groups_data["default_group_id"] = group_id
             save_groups(groups_data)
             print(f"Created default group with ID: {group_id}")
@@ -171,6 +422,30 @@ async def ensure_default_group():
     
     return groups_data.get("default_group_id")
 
+# Uploads are spread over several storage groups, so no single megagroup
+# takes all the messages and all the rate limits
+placement = GroupPlacement(STORAGE_PLACEMENT, STORAGE_GROUP_MAX_MESSAGES, STORAGE_GROUP_MAX_PER_MINUTE)
+group_create_lock = asyncio.Lock()
+
+async def choose_group(folder_id, digest):
+    """Storage group for an upload, creating one only when the groups it could go to are full"""
+    await ensure_default_group()
+    async with group_create_lock:
+        groups_data = load_groups()
+        group_id = placement.choose(groups_data, folder_id, digest, store.group_message_count)
+        if group_id is None and placement.created(groups_data) < STORAGE_GROUP_LIMIT:
+            try:
+                number = placement.created(groups_data) + 2
+                group_id = await create_group(groups_data, f"TG Drive Storage {number}", "More storage for TG Drive files")
+                placement.assign(groups_data, folder_id, group_id)
+                save_groups(groups_data)
+                print(f"Created storage group {number} with ID: {group_id}")
+            except Exception as e:
+                print(f"Error creating storage group: {e}")
+        if group_id is None:
+            group_id = placement.least_busy(groups_data, folder_id, store.group_message_count)
+    return group_id
+
 def verify_telegram_auth(auth_data):
     """Verify Telegram authentication data using hash validation"""
     try:
@@ -218,41 +493,220 @@ async def get_current_user(authorization: str = Header(None)):
     payload = verify_jwt_token(token)
     if not payload:
         raise HTTPException(status_code=401, detail="Invalid token")
+    # Every signed-in endpoint reads the store
+    await get_store()
     return payload
 
-async def init_telegram():
+# Telegram connects in the background so the server is up immediately.
+# Metadata endpoints serve while it warms up; Telegram-backed ones await
+# telegram_ready, which resolves to the pool, or None if it is unavailable.
+# Each operation leases the least-loaded session of the pool. Every RPC then
+# waits its turn in that session's scheduler: calls default to interactive
+# priority, uploads and purges run as background work.
+telegram_pool = TelegramPool(
+    API_ID, API_HASH, TELEGRAM_SESSIONS, TELEGRAM_BOT_TOKENS,
+    rate=TELEGRAM_RPC_RATE,
+    burst=TELEGRAM_RPC_BURST,
+    reserve=TELEGRAM_RPC_RESERVE,
+    max_flood_wait=TELEGRAM_MAX_FLOOD_WAIT
+)
+telegram_ready = None
+telegram_task = None
+
+async def connect_telegram():
+    """Connect the pool, retrying with backoff until every session is up
+
+    Requests waiting on a first attempt that fails get "unavailable" rather
+    than hang; the retries go on, and telegram_ready is replaced by the
+    connected pool once one of them succeeds. Once every session is up,
+    the pool is watched and sessions that drop are connected again.
+    """
+    global telegram_ready
+    delay = TELEGRAM_CONNECT_RETRY
+    while True:
+        try:
+            telegram_pool.mark_dropped()
+            pending = [session for session in telegram_pool.sessions if session.state != "connected"]
+            connected = await telegram_pool.connect()
+            if not connected:
+                raise RuntimeError("no session could connect")
+            
+            default_group_id = await ensure_default_group()
+            for session in pending:
+                if session.state != "connected":
+                    continue
+                try:
+                    await resolve_group(default_group_id, session.client)
+                except Exception as e:
+                    print(f"Telegram session {session.name} cannot reach default group {default_group_id}: {e}")
+            
+            if not telegram_ready.done():
+                telegram_ready.set_result(telegram_pool)
+            elif telegram_ready.result() is None:
+                telegram_ready = asyncio.get_running_loop().create_future()
+                telegram_ready.set_result(telegram_pool)
+            print(f"Telegram started with {connected} of {len(telegram_pool)} sessions")
+            if connected == len(telegram_pool):
+                await telegram_pool.watch(TELEGRAM_HEALTH_INTERVAL)
+                delay = TELEGRAM_CONNECT_RETRY
+                continue
+        except Exception as e:
+            print(f"Telegram client error: {e}")
+            if not telegram_ready.done():
+                telegram_ready.set_result(None)
+        
+        print(f"Retrying Telegram connection in {delay:.0f}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, TELEGRAM_CONNECT_RETRY_MAX)
+
+async def get_telegram(timeout=TELEGRAM_READY_TIMEOUT):
+    """The connected pool, waiting up to timeout for the background connect"""
+    if telegram_ready is None:
+        raise HTTPException(status_code=503, detail="Telegram is not started")
     try:
-        # await client.start()
-        await client.get_dialogs()
-        await ensure_default_group()
-        print("Telegram client started successfully")
-    except Exception as e:
-        print(f"Telegram client error: {e}")
-# Fix the startup event
+        pool = await asyncio.wait_for(asyncio.shield(telegram_ready), timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Telegram is still connecting", headers={"Retry-After": "5"})
+    if pool is None:
+        raise HTTPException(status_code=503, detail="Telegram is unavailable", headers={"Retry-After": str(TELEGRAM_CONNECT_RETRY)})
+    return pool
+
+def channel_id_of(group_id):
+    channel_id = int(group_id)
+    if channel_id < 0:
+        channel_id, _ = utils.resolve_id(channel_id)
+    return channel_id
+
+@asynccontextmanager
+async def telegram_session(group_id=None, timeout=TELEGRAM_READY_TIMEOUT):
+    """Lease the least-loaded Telegram session for one operation; yields its client
+
+    With a group_id, only sessions that can reach that storage group are
+    considered.
+    """
+    pool = await get_telegram(timeout)
+    session = pool.pick(None if group_id is None else channel_id_of(group_id))
+    if session is None:
+        retry_after = pool.retry_after()
+        raise HTTPException(
+            status_code=503,
+            detail="Every Telegram session is rate limited" if retry_after else "No Telegram session is available",
+            headers={"Retry-After": str(retry_after or 5)}
+        )
+    async with pool.lease(session):
+        yield session.client
+
+async def stream_leased(session, chunks):
+    """Hold a session's lease for as long as a response streams from it"""
+    async with telegram_pool.lease(session):
+        async for chunk in chunks:
+            yield chunk
+
+def saved_access_hashes(groups_data, session):
+    """A session's channel access hashes as kept in tg_groups.json
+
+    The first session's live under "access_hashes"; the others' under
+    "session_access_hashes", by a digest of their credential.
+    """
+    if session is telegram_pool.sessions[0]:
+        return groups_data.setdefault("access_hashes", {})
+    return groups_data.setdefault("session_access_hashes", {}).setdefault(session.key, {})
+
+async def resolve_group(group_id, connected):
+    """Input peer for a storage group, as seen by the session of connected
+
+    Access hashes differ between accounts. Each session resolves a channel
+    once and its hash is saved in tg_groups.json, so later starts need no
+    dialog fetch.
+    """
+    channel_id = channel_id_of(group_id)
+    session = connected.pool_session
+    if channel_id in session.peers:
+        return session.peers[channel_id]
+    
+    groups_data = load_groups()
+    access_hash = saved_access_hashes(groups_data, session).get(str(channel_id))
+    if access_hash is not None:
+        peer = InputPeerChannel(channel_id, access_hash)
+    else:
+        try:
+            try:
+                peer = await connected.get_input_entity(PeerChannel(channel_id))
+            except ValueError:
+                if session.kind == "bot":
+                    raise
+                # A user session only knows the channels it has seen in its dialogs
+                await connected.get_dialogs()
+                peer = await connected.get_input_entity(PeerChannel(channel_id))
+        except ValueError:
+            # Not a member; leases for this group go to other sessions from now on
+            session.unreachable.add(channel_id)
+            raise
+        # Reloaded, as a group may have been added while this was resolving
+        groups_data = load_groups()
+        saved_access_hashes(groups_data, session)[str(channel_id)] = peer.access_hash
+        save_groups(groups_data)
+    
+    session.peers[channel_id] = peer
+    return peer
+
+def telegram_state():
+    if not len(telegram_pool):
+        return "disabled"
+    if telegram_ready is None or not telegram_ready.done():
+        return "connecting"
+    return "connected" if telegram_ready.result() else "unavailable"
+
 @app.on_event("startup")
 async def startup_event():
-    try:
-        # Initialize Telegram client properly
-        global client
-        if SESSION_STRING:
-            client = TelegramClient(StringSession(SESSION_STRING), API_ID, API_HASH)
-            await client.start()
-            await ensure_default_group()
-            print("Telegram client started successfully")
-        else:
-            print("No session string provided, skipping Telegram client")
-        
-        migrate_database()
-        print("Application started successfully")
-    except Exception as e:
-        print(f"Startup warning: {e}")
-        # Don't crash the app if Telegram client fails
-        migrate_database()
-        print("Application started without Telegram client")
+    global telegram_ready, telegram_task
+    telegram_ready = asyncio.get_running_loop().create_future()
+    if len(telegram_pool):
+        telegram_task = asyncio.create_task(connect_telegram())
+    else:
+        print("No session string or bot token provided, skipping Telegram client")
+        telegram_ready.set_result(None)
+    print("Application started successfully")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if telegram_task:
+        telegram_task.cancel()
+        await asyncio.gather(telegram_task, return_exceptions=True)
+    await telegram_pool.disconnect()
+
+# Health endpoints
+@app.get("/api/health/live")
+async def liveness():
+    """The process is up and serving requests"""
+    return {"status": "alive"}
+
+@app.get("/api/health/ready")
+async def readiness():
+    """503 while metadata loads or Telegram is still connecting, or if metadata failed to load"""
+    state = telegram_state()
+    metadata = store_state()
+    if metadata == "failed":
+        status = "failed"
+    elif metadata == "loading" or state == "connecting":
+        status = "starting"
+    else:
+        status = "ready"
+    content = {
+        "status": status,
+        "metadata": metadata,
+        "telegram": state,
+        "telegram_sessions": telegram_pool.status()
+    }
+    if metadata == "loaded":
+        content["files"] = store.count_files()
+        content["pending_migrations"] = store.pending_migrations()
+    return JSONResponse(status_code=200 if status == "ready" else 503, content=content)
 
 # Authentication endpoints
 @app.post("/api/auth/telegram")
 async def telegram_login(request: Request):
+    await get_store()
     try:
         data = await request.json()
         print(f"Received auth data: {data}")
@@ -260,16 +714,10 @@ async def telegram_login(request: Request):
         if not verify_telegram_auth(data):
             raise HTTPException(status_code=401, detail="Invalid Telegram authentication")
         
-        db = load_db()
-        
         user_id = data['id']
         
         # Find or create user
-        existing_user = None
-        for user in db['users']:
-            if user['id'] == user_id:
-                existing_user = user
-                break
+        existing_user = store.get_user(user_id)
         
         if not existing_user:
             user_record = {
@@ -279,8 +727,7 @@ async def telegram_login(request: Request):
                 'last_name': sanitize_filename(data.get('last_name', '')),
                 'created_at': datetime.now().isoformat()
             }
-            db['users'].append(user_record)
-            save_db(db)
+            store.insert_user(user_record)
             print(f"Created new user: {user_record}")
         
         token = create_jwt_token(data)
@@ -311,49 +758,429 @@ async def verify_token(authorization: str = Header(None)):
     
     return {"valid": True, "user": payload}
 
+def file_size(fileobj):
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+async def upload_segments(group_id, fileobj, size, name, caption, progress=None):
+    """Send a file too big for one Telegram document as several messages
+
+    Each segment leases its own session, so segments are spread over the
+    pool, TELEGRAM_SEGMENT_PARALLELISM per session at a time. Returns the
+    segment manifest kept on the record.
+    """
+    ranges = segment_ranges(size, TELEGRAM_SEGMENT_SIZE)
+    semaphore = asyncio.Semaphore(TELEGRAM_SEGMENT_PARALLELISM * max(1, len(telegram_pool)))
+    sent = []
+    
+    async def send_segment(index, start, length):
+        async with semaphore, telegram_session(group_id) as connected:
+            input_file, digest = await upload_stream(
+                connected, FileSlice(fileobj, start, length), length, f"{name}.{index + 1:03d}",
+                parallel=TELEGRAM_UPLOAD_PARALLELISM,
+                retries=TELEGRAM_PART_RETRIES,
+                max_flood_wait=TELEGRAM_MAX_FLOOD_WAIT,
+                progress=progress
+            )
+            message = await connected.send_file(
+                await resolve_group(group_id, connected), input_file,
+                caption=f"{caption}\n🧩 {index + 1}/{len(ranges)}", force_document=True
+            )
+            sent.append(message.id)
+            placement.sent(group_id)
+            return {"telegram_file_id": str(message.id), "size": length, "sha256": digest}
+    
+    tasks = [asyncio.create_task(send_segment(i, start, length)) for i, (start, length) in enumerate(ranges)]
+    try:
+        segments = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        # A send that completes while being cancelled still lands in sent
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if sent:
+            try:
+                async with telegram_session(group_id) as connected:
+                    await connected.delete_messages(await resolve_group(group_id, connected), sent)
+            except Exception as e:
+                print(f"Error removing segments of failed upload: {e}")
+        raise
+    return list(segments)
+
+# Record fields that say where a file's bytes are
+STORAGE_FIELDS = ("telegram_file_id", "telegram_group_id", "segments", "blob")
+
+def find_stored_copy(digest, size):
+    """Storage fields of an existing file with this content in Telegram, or None
+
+    Blob-only copies are not reused: the blob store is local disk that does
+    not outlive a redeploy, so content kept there while Telegram was down
+    still goes to Telegram when uploaded again. Identical blobs share one
+    file anyway, as the store is content-addressed.
+    """
+    for candidate in store.files_with_hash(digest):
+        if candidate.get("size") != size or candidate["id"] in purging_files:
+            continue
+        if any(key[0] == "telegram" for key in storage_keys(candidate)):
+            return {field: candidate[field] for field in STORAGE_FIELDS if field in candidate}
+    return None
+
+async def store_file_body(fileobj, name, mime_type, folder_id, current_user, progress=None):
+    """Stream an upload to Telegram, or into the blob store if Telegram is disabled
+
+    Content already stored under the same SHA-256 is not transferred again;
+    the new record points at the existing copy instead. Returns the record
+    fields locating the body: size, sha256, and either
+    telegram_file_id/telegram_group_id, segments/telegram_group_id or blob.
+    progress(n) is called as each n bytes reach Telegram. Telegram errors
+    are raised, so the staged upload can be sent again later.
+    """
+    # The body is spooled on disk, so hashing it first costs a local read
+    # and lets duplicates skip the transfer entirely
+    size = await asyncio.to_thread(file_size, fileobj)
+    digest = await asyncio.to_thread(hash_file, fileobj, size)
+    existing = find_stored_copy(digest, size)
+    if existing:
+        print(f"{name} is already stored, reusing its copy")
+        return {"size": size, "sha256": digest, **existing}
+    
+    if telegram_state() == "disabled":
+        await asyncio.to_thread(fileobj.seek, 0)
+        blob, size = await asyncio.to_thread(blobs.put_stream, fileobj)
+        return {"size": size, "sha256": blob, "blob": blob}
+    
+    await get_telegram()
+    group_id = await choose_group(folder_id, digest)
+    caption = f"📁 {name}\n👤 {current_user['first_name']}\n📅 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    
+    if size > TELEGRAM_SEGMENT_SIZE:
+        segments = await upload_segments(group_id, fileobj, size, name, caption, progress)
+        print(f"File uploaded to Telegram as {len(segments)} segments")
+        return {"size": size, "sha256": digest, "segments": segments, "telegram_group_id": group_id}
+    
+    async with telegram_session(group_id) as connected:
+        peer = await resolve_group(group_id, connected)
+        input_file, sent_digest = await upload_stream(
+            connected, fileobj, size, name,
+            parallel=TELEGRAM_UPLOAD_PARALLELISM,
+            retries=TELEGRAM_PART_RETRIES,
+            max_flood_wait=TELEGRAM_MAX_FLOOD_WAIT,
+            progress=progress
+        )
+        if sent_digest != digest:
+            raise IOError(f"{name} changed while it was being uploaded")
+        message = await connected.send_file(
+            peer,
+            input_file,
+            caption=caption,
+            mime_type=mime_type,
+            force_document=True
+        )
+    placement.sent(group_id)
+    print(f"File uploaded to Telegram, message ID: {message.id}")
+    return {"size": size, "sha256": digest, "telegram_file_id": str(message.id), "telegram_group_id": group_id}
+
+def create_file_record(name, mime_type, folder_id, current_user, body):
+    """Save the record for an uploaded file; body is from store_file_body()"""
+    file_record = {
+        "id": store.allocate_id(),
+        "name": name,
+        "size": body.pop("size"),
+        "mime_type": mime_type,
+        "folder_id": folder_id,
+        "uploaded_by": current_user['user_id'],
+        "created_at": datetime.now().isoformat(),
+        "is_deleted": False,
+        "starred": False,
+        **body
+    }
+    return record_json(store.put_file(file_record))
+
+# Resumable uploads: create a session, PUT the body in chunks at the
+# committed offset (resuming from GET after a dropped connection), then
+# finalize to send it on to Telegram
+upload_sessions = UploadSessions(UPLOAD_DIR, UPLOAD_SESSION_TTL)
+upload_sweep_task = None
+
+def session_info(session):
+    return {
+        "upload_id": session["id"],
+        "name": session["name"],
+        "size": session["size"],
+        "offset": session["offset"],
+        "chunk_size": UPLOAD_CHUNK_SIZE,
+        "expires_at": datetime.fromtimestamp(session["updated_at"] + UPLOAD_SESSION_TTL).isoformat()
+    }
+
+def get_upload_session(upload_id, current_user):
+    session = upload_sessions.get(upload_id)
+    if not session or session["user_id"] != current_user['user_id']:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+async def expire_upload_sessions_periodically():
+    while True:
+        try:
+            expired = await asyncio.to_thread(upload_sessions.expire)
+            if expired:
+                print(f"Expired {len(expired)} stale upload sessions")
+        except Exception as e:
+            print(f"Error expiring upload sessions: {e}")
+        await asyncio.sleep(min(UPLOAD_SESSION_TTL, 3600))
+
+@app.on_event("startup")
+async def start_upload_sweeper():
+    global upload_sweep_task
+    upload_sweep_task = asyncio.create_task(expire_upload_sessions_periodically())
+
+@app.on_event("shutdown")
+async def stop_upload_sweeper():
+    if upload_sweep_task:
+        upload_sweep_task.cancel()
+        await asyncio.gather(upload_sweep_task, return_exceptions=True)
+
+# Uploads are staged as a session and then sent to Telegram by a background
+# job, so the request returns a job ID at once and the transfer can be
+# followed and cancelled
+upload_jobs = UploadJobs(UPLOAD_QUEUE_SIZE, UPLOAD_WORKERS, UPLOAD_JOB_TTL)
+
+@app.on_event("startup")
+async def start_upload_jobs():
+    upload_jobs.start()
+    # Uploads accepted before the last shutdown are staged on disk still
+    for session in upload_sessions.queued():
+        if not upload_sessions.claim(session["id"]):
+            continue
+        user = {"user_id": session["user_id"], "first_name": session.get("first_name", "")}
+        try:
+            enqueue_upload(session, user, client_id=session.get("client_id"))
+        except HTTPException as e:
+            upload_sessions.release(session["id"])
+            print(f"Could not requeue upload {session['id']}: {e.detail}")
+
+@app.on_event("shutdown")
+async def stop_upload_jobs():
+    await upload_jobs.stop()
+
+def job_info(job):
+    return {**upload_jobs.info(job), "upload_id": job["upload_id"]}
+
+def get_upload_job(job_id, current_user):
+    job = upload_jobs.get(job_id)
+    if not job:
+        # The web client cancels by the upload_id it sent with the form
+        job = next((
+            j for j in upload_jobs.jobs.values()
+            if j.get("client_id") == job_id and j["user_id"] == current_user['user_id']
+        ), None)
+    if not job or job["user_id"] != current_user['user_id']:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return job
+
+def enqueue_upload(session, current_user, client_id=None):
+    """Queue a complete, claimed session to be sent on to Telegram
+
+    The session is removed once its file record exists, or when the job is
+    cancelled; a failed job leaves it in place so it can be finalized again.
+    A job interrupted by a shutdown is queued again on the next start.
+    """
+    upload_id = session["id"]
+    session["queued"] = True
+    session["client_id"] = client_id
+    upload_sessions.touch(session)
+    
+    async def run(job):
+        # Jobs requeued at startup may run before the store has loaded
+        await get_store(timeout=None)
+        waited = 0
+        while True:
+            try:
+                with priority(BACKGROUND), open(upload_sessions.part_path(upload_id), 'rb') as f:
+                    body = await store_file_body(f, session["name"], session["mime_type"], session["folder_id"], current_user, job["progress"])
+                break
+            except HTTPException as e:
+                # Telegram still connecting, or every session rate limited
+                if e.status_code != 503 or waited >= UPLOAD_TELEGRAM_WAIT:
+                    raise RuntimeError(e.detail) from e
+                delay = min(int((e.headers or {}).get("Retry-After", 5)), UPLOAD_TELEGRAM_WAIT - waited)
+                print(f"{e.detail}, retrying {session['name']} in {delay}s")
+                job["bytes_sent"] = 0
+                await asyncio.sleep(delay)
+                waited += delay
+        file_record = create_file_record(session["name"], session["mime_type"], session["folder_id"], current_user, body)
+        upload_sessions.remove(upload_id)
+        return file_record
+    
+    def cleanup(job):
+        if job["status"] == "cancelled":
+            upload_sessions.remove(upload_id)
+        elif job["status"] == "failed":
+            session.pop("queued", None)
+            upload_sessions.touch(session)
+        upload_sessions.release(upload_id)
+    
+    try:
+        job = upload_jobs.submit(
+            run, cleanup,
+            name=session["name"],
+            size=session["size"],
+            user_id=current_user['user_id'],
+            upload_id=upload_id,
+            client_id=client_id
+        )
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Upload queue is full, try again later")
+    print(f"Queued upload job {job['id']} for {session['name']}")
+    return job_info(job)
+
+def stage_upload_body(fileobj, path):
+    fileobj.seek(0)
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(fileobj, f, UPLOAD_CHUNK_SIZE)
+    return os.path.getsize(path)
+
 @app.post("/api/upload")
 async def upload_file(
     file: UploadFile = File(...), 
     folder_id: int = Form(0),
+    upload_id: Optional[str] = Form(None),
     current_user: dict = Depends(get_current_user)
 ):
+    if upload_jobs.queue.full():
+        raise HTTPException(status_code=503, detail="Upload queue is full, try again later")
+    session = None
     try:
-        db = load_db()
-        content = await file.read()
-        
-        # Store file content directly (for demo purposes)
-        file_record = {
-            "id": db["next_id"],
-            "name": sanitize_filename(file.filename),
-            "size": len(content),
-            "mime_type": file.content_type or "application/octet-stream",
-            "folder_id": folder_id,
-            "uploaded_by": current_user['user_id'],
-            "created_at": datetime.now().isoformat(),
-            "is_deleted": False,
-            "starred": False,
-            "content": base64.b64encode(content).decode('utf-8')  # Store as base64
-        }
-        
-        db["files"].append(file_record)
-        db["next_id"] += 1
-        save_db(db)
-        
-        # Remove content from response
-        response_record = file_record.copy()
-        del response_record['content']
+        clean_filename = sanitize_filename(file.filename)
+        session = upload_sessions.create(
+            name=clean_filename,
+            size=0,
+            mime_type=file.content_type or "application/octet-stream",
+            folder_id=folder_id,
+            user_id=current_user['user_id'],
+            first_name=current_user.get('first_name', '')
+        )
+        upload_sessions.claim(session["id"])
         
-        return response_record
+        # The multipart body is spooled to a temporary file that goes away
+        # with the request, so the job gets its own copy to read from
+        session["size"] = await asyncio.to_thread(stage_upload_body, file.file, upload_sessions.part_path(session["id"]))
+        upload_sessions.touch(session)
+        return enqueue_upload(session, current_user, client_id=upload_id)
         
     except Exception as e:
+        if session:
+            upload_sessions.remove(session["id"])
+            upload_sessions.release(session["id"])
+        if isinstance(e, HTTPException):
+            raise
         print(f"Upload error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
-     
+
+@app.get("/api/upload/jobs")
+async def list_upload_jobs(current_user: dict = Depends(get_current_user)):
+    upload_jobs.expire()
+    return [job_info(job) for job in upload_jobs.jobs.values() if job["user_id"] == current_user['user_id']]
+
+@app.get("/api/upload/jobs/{job_id}")
+async def get_upload_job_status(job_id: str, current_user: dict = Depends(get_current_user)):
+    return job_info(get_upload_job(job_id, current_user))
+
 @app.post("/api/upload/cancel/{upload_id}")
 async def cancel_upload(upload_id: str, current_user: dict = Depends(get_current_user)):
-    active_uploads[upload_id] = {'cancelled': True}
-    print(f"Upload {upload_id} marked for cancellation")
-    return {"message": "Upload cancelled"}
+    job = get_upload_job(upload_id, current_user)
+    if not upload_jobs.cancel(job):
+        raise HTTPException(status_code=409, detail=f"Upload already {job['status']}")
+    print(f"Upload job {job['id']} cancelled")
+    return {"message": "Upload cancelled", **job_info(job)}
+
+@app.post("/api/uploads")
+async def create_upload_session(request: Request, current_user: dict = Depends(get_current_user)):
+    try:
+        data = await request.json()
+        size = data.get("size")
+        if not isinstance(size, int) or size < 0:
+            raise HTTPException(status_code=400, detail="size must be a non-negative integer")
+        
+        session = upload_sessions.create(
+            name=sanitize_filename(data.get("name")),
+            size=size,
+            mime_type=data.get("mime_type") or "application/octet-stream",
+            folder_id=int(data.get("folder_id", 0)),
+            user_id=current_user['user_id'],
+            first_name=current_user.get('first_name', '')
+        )
+        return session_info(session)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Create upload session error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/uploads/{upload_id}")
+async def get_upload_offset(upload_id: str, current_user: dict = Depends(get_current_user)):
+    return session_info(get_upload_session(upload_id, current_user))
+
+@app.put("/api/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: dict = Depends(get_current_user)
+):
+    session = get_upload_session(upload_id, current_user)
+    if offset != session["offset"]:
+        raise HTTPException(status_code=409, detail={"message": "Offset does not match", "offset": session["offset"]})
+    if not upload_sessions.claim(upload_id):
+        raise HTTPException(status_code=409, detail="Another chunk is being written")
+    
+    try:
+        # Written as it arrives; whatever made it to disk before a dropped
+        # connection stays committed, and the client resumes from there
+        with open(upload_sessions.part_path(upload_id), 'ab') as f:
+            async for data in request.stream():
+                if offset + len(data) > session["size"]:
+                    raise HTTPException(status_code=413, detail="Chunk goes past the declared size")
+                await asyncio.to_thread(f.write, data)
+                offset += len(data)
+        session["offset"] = offset
+        upload_sessions.touch(session)
+        return session_info(session)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Upload chunk error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        upload_sessions.release(upload_id)
+
+@app.post("/api/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, current_user: dict = Depends(get_current_user)):
+    session = get_upload_session(upload_id, current_user)
+    if session["offset"] != session["size"]:
+        raise HTTPException(status_code=409, detail={"message": "Upload is incomplete", "offset": session["offset"]})
+    if not upload_sessions.claim(upload_id):
+        raise HTTPException(status_code=409, detail="Upload is busy")
+    
+    try:
+        # Released by the job once it has finished
+        return enqueue_upload(session, current_user)
+    except Exception as e:
+        upload_sessions.release(upload_id)
+        if isinstance(e, HTTPException):
+            raise
+        print(f"Finalize upload error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/api/uploads/{upload_id}")
+async def abort_upload(upload_id: str, current_user: dict = Depends(get_current_user)):
+    get_upload_session(upload_id, current_user)
+    if not upload_sessions.claim(upload_id):
+        raise HTTPException(status_code=409, detail="Upload is busy")
+    upload_sessions.remove(upload_id)
+    upload_sessions.release(upload_id)
+    return {"message": "Upload aborted"}
 
 # FIXED: Star/Unstar file endpoint
 # FIXED: Star/Unstar file endpoint with better error handling
@@ -362,20 +1189,10 @@ async def toggle_star(file_id: int, current_user: dict = Depends(get_current_use
     try:
         print(f"Attempting to star/unstar file ID: {file_id}")
         
-        db = load_db()
-        file_record = None
-        file_index = None
-        
-        # Find the file with better error checking
-        for i, f in enumerate(db["files"]):
-            if f.get("id") == file_id and not f.get("is_deleted", False):
-                file_record = f
-                file_index = i
-                break
+        file_record = get_live_file(file_id)
         
         if not file_record:
             print(f"File with ID {file_id} not found in database")
-            print(f"Available file IDs: {[f.get('id') for f in db['files'][:10]]}")  # Show first 10 IDs for debugging
             raise HTTPException(status_code=404, detail=f"File with ID {file_id} not found")
         
         # Ensure starred field exists
@@ -387,8 +1204,7 @@ async def toggle_star(file_id: int, current_user: dict = Depends(get_current_use
         file_record["starred_at"] = datetime.now().isoformat()
         
         # Update the database
-        db["files"][file_index] = file_record
-        save_db(db)
+        store.put_file(file_record)
         
         print(f"File {file_id} starred status changed to: {file_record['starred']}")
         
@@ -407,50 +1223,26 @@ async def toggle_star(file_id: int, current_user: dict = Depends(get_current_use
 
 # FIXED: Get starred files endpoint
 @app.get("/api/files/starred")
-async def get_starred_files(current_user: dict = Depends(get_current_user)):
+async def get_starred_files(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     try:
-        db = load_db()
-        starred_files = []
-        for f in db["files"]:
-            if f.get("starred", False) and not f.get("is_deleted", False):
-                file_copy = f.copy()
-                if 'content' in file_copy:
-                    del file_copy['content']
-                starred_files.append(file_copy)
+        if limit is not None or after is not None:
+            limit, after_id = page_params(limit, after)
+            return keyset_page(store.list_files(is_deleted=False, starred=True, after=after_id, limit=limit + 1), limit)
+        
+        starred_files = store.list_files(is_deleted=False, starred=True)
         
         print(f"Found {len(starred_files)} starred files")
-        return safe_json_encode(starred_files)
+        return file_json(starred_files)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Get starred files error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-def migrate_database():
-    """Add missing fields to existing files"""
-    try:
-        db = load_db()
-        updated = False
-        
-        for file_record in db["files"]:
-            # Add starred field if missing
-            if "starred" not in file_record:
-                file_record["starred"] = False
-                updated = True
-            
-            # Ensure is_deleted field exists
-            if "is_deleted" not in file_record:
-                file_record["is_deleted"] = False
-                updated = True
-        
-        if updated:
-            save_db(db)
-            print("Database migrated successfully - added missing fields")
-        
-    except Exception as e:
-        print(f"Database migration error: {e}")
-
-# Add this to your startup event
-
-
 # NEW: Copy file endpoint
 @app.post("/api/files/{file_id}/copy")
 async def copy_file(file_id: int, request: Request, current_user: dict = Depends(get_current_user)):
@@ -459,19 +1251,16 @@ async def copy_file(file_id: int, request: Request, current_user: dict = Depends
         target_folder_id = data.get('folder_id', 0)
         new_name = data.get('name', None)
         
-        db = load_db()
-        file_record = None
-        for f in db["files"]:
-            if f["id"] == file_id and not f.get("is_deleted", False):
-                file_record = f
-                break
+        file_record = get_live_file(file_id)
         
         if not file_record:
             raise HTTPException(status_code=404, detail="File not found")
         
-        # Create copy
+        # Create copy; a legacy record is migrated first, or the copy would
+        # be stored as current with its content still inline
+        file_record = await migrated_file(file_record)
         new_file = file_record.copy()
-        new_file["id"] = db["next_id"]
+        new_file["id"] = store.allocate_id()
         new_file["folder_id"] = target_folder_id
         new_file["created_at"] = datetime.now().isoformat()
         new_file["is_deleted"] = False
@@ -484,16 +1273,7 @@ async def copy_file(file_id: int, request: Request, current_user: dict = Depends
             # Add "Copy of" prefix
             new_file["name"] = f"Copy of {file_record['name']}"
         
-        db["files"].append(new_file)
-        db["next_id"] += 1
-        save_db(db)
-        
-        # Remove content from response
-        response_record = new_file.copy()
-        if 'content' in response_record:
-            del response_record['content']
-        
-        return safe_json_encode(response_record)
+        return record_json(store.put_file(new_file))
         
     except Exception as e:
         print(f"Copy file error: {str(e)}")
@@ -513,12 +1293,7 @@ async def rename_file(
         if not new_name:
             raise HTTPException(status_code=400, detail="Invalid file name")
         
-        db = load_db()
-        file_record = None
-        for f in db["files"]:
-            if f["id"] == file_id and not f.get("is_deleted", False):
-                file_record = f
-                break
+        file_record = get_live_file(file_id)
         
         if not file_record:
             raise HTTPException(status_code=404, detail="File not found")
@@ -538,7 +1313,7 @@ async def rename_file(
         file_record["name"] = new_name
         file_record["renamed_at"] = datetime.now().isoformat()
         
-        save_db(db)
+        store.put_file(file_record)
         
         return {
             "message": "File renamed successfully",
@@ -555,18 +1330,13 @@ async def rename_file(
 @app.get("/api/files/{file_id}/versions")
 async def get_file_versions(file_id: int, current_user: dict = Depends(get_current_user)):
     try:
-        db = load_db()
-        file_record = None
-        for f in db["files"]:
-            if f["id"] == file_id and not f.get("is_deleted", False):
-                file_record = f
-                break
+        file_record = get_live_file(file_id)
         
         if not file_record:
             raise HTTPException(status_code=404, detail="File not found")
         
         versions = file_record.get("versions", [])
-        return safe_json_encode(versions)
+        return versions
         
     except Exception as e:
         print(f"Get file versions error: {str(e)}")
@@ -581,12 +1351,7 @@ async def restore_file_version(file_id: int, request: Request, current_user: dic
         if version_number is None:
             raise HTTPException(status_code=400, detail="Version number required")
         
-        db = load_db()
-        file_record = None
-        for f in db["files"]:
-            if f["id"] == file_id and not f.get("is_deleted", False):
-                file_record = f
-                break
+        file_record = get_live_file(file_id)
         
         if not file_record:
             raise HTTPException(status_code=404, detail="File not found")
@@ -615,7 +1380,7 @@ async def restore_file_version(file_id: int, request: Request, current_user: dic
         file_record["restored_at"] = datetime.now().isoformat()
         file_record["restored_from_version"] = version_number
         
-        save_db(db)
+        store.put_file(file_record)
         
         return {
             "message": "File version restored successfully",
@@ -629,19 +1394,22 @@ async def restore_file_version(file_id: int, request: Request, current_user: dic
 
 # FIXED: Get deleted files (bin) endpoint
 @app.get("/api/files/bin")
-async def get_bin_files(current_user: dict = Depends(get_current_user)):
+async def get_bin_files(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     try:
-        db = load_db()
-        bin_files = []
-        for f in db["files"]:
-            if f.get("is_deleted", False):
-                file_copy = f.copy()
-                if 'content' in file_copy:
-                    del file_copy['content']
-                bin_files.append(file_copy)
+        if limit is not None or after is not None:
+            limit, after_id = page_params(limit, after)
+            return keyset_page(store.list_files(is_deleted=True, after=after_id, limit=limit + 1), limit)
+        
+        bin_files = store.list_files(is_deleted=True)
         
         print(f"Found {len(bin_files)} files in bin")
-        return safe_json_encode(bin_files)
+        return file_json(bin_files)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Get bin files error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -650,14 +1418,9 @@ async def get_bin_files(current_user: dict = Depends(get_current_user)):
 @app.post("/api/files/{file_id}/restore")
 async def restore_file(file_id: int, current_user: dict = Depends(get_current_user)):
     try:
-        db = load_db()
-        file_record = None
-        for f in db["files"]:
-            if f["id"] == file_id and f.get("is_deleted", False):
-                file_record = f
-                break
+        file_record = store.get_file(file_id)
         
-        if not file_record:
+        if not file_record or not file_record.get("is_deleted", False):
             raise HTTPException(status_code=404, detail="File not found in bin")
         
         file_record["is_deleted"] = False
@@ -665,7 +1428,7 @@ async def restore_file(file_id: int, current_user: dict = Depends(get_current_us
         if "deleted_at" in file_record:
             del file_record["deleted_at"]
         
-        save_db(db)
+        store.put_file(file_record)
         
         return {"message": "File restored successfully", "file_id": file_id}
     except Exception as e:
@@ -684,15 +1447,11 @@ async def bulk_operations(request: Request, current_user: dict = Depends(get_cur
         if not operation or not file_ids:
             raise HTTPException(status_code=400, detail="Operation and file_ids required")
         
-        db = load_db()
         results = []
+        changed = []
         
         for file_id in file_ids:
-            file_record = None
-            for f in db["files"]:
-                if f["id"] == file_id and not f.get("is_deleted", False):
-                    file_record = f
-                    break
+            file_record = get_live_file(file_id)
             
             if not file_record:
                 results.append({"file_id": file_id, "status": "not_found"})
@@ -701,11 +1460,13 @@ async def bulk_operations(request: Request, current_user: dict = Depends(get_cur
             if operation == "move":
                 file_record["folder_id"] = target_folder_id
                 file_record["moved_at"] = datetime.now().isoformat()
+                changed.append(file_record)
                 results.append({"file_id": file_id, "status": "moved"})
                 
             elif operation == "copy":
+                file_record = await migrated_file(file_record)
                 new_file = file_record.copy()
-                new_file["id"] = db["next_id"]
+                new_file["id"] = store.allocate_id()
                 new_file["folder_id"] = target_folder_id
                 new_file["created_at"] = datetime.now().isoformat()
                 new_file["is_deleted"] = False
@@ -713,24 +1474,26 @@ async def bulk_operations(request: Request, current_user: dict = Depends(get_cur
                 new_file["versions"] = []
                 new_file["name"] = f"Copy of {file_record['name']}"
                 
-                db["files"].append(new_file)
-                db["next_id"] += 1
+                changed.append(new_file)
                 results.append({"file_id": file_id, "status": "copied", "new_id": new_file["id"]})
                 
             elif operation == "delete":
                 file_record["is_deleted"] = True
                 file_record["deleted_at"] = datetime.now().isoformat()
+                changed.append(file_record)
                 results.append({"file_id": file_id, "status": "deleted"})
                 
             elif operation == "star":
                 file_record["starred"] = True
+                changed.append(file_record)
                 results.append({"file_id": file_id, "status": "starred"})
                 
             elif operation == "unstar":
                 file_record["starred"] = False
+                changed.append(file_record)
                 results.append({"file_id": file_id, "status": "unstarred"})
         
-        save_db(db)
+        store.put_files(changed)
         
         return {
             "message": f"Bulk {operation} completed",
@@ -746,12 +1509,7 @@ async def bulk_operations(request: Request, current_user: dict = Depends(get_cur
 @app.get("/api/files/{file_id}/preview")
 async def preview_file(file_id: int, current_user: dict = Depends(get_current_user)):
     try:
-        db = load_db()
-        file_record = None
-        for f in db["files"]:
-            if f["id"] == file_id and not f.get("is_deleted", False):
-                file_record = f
-                break
+        file_record = get_live_file(file_id)
         
         if not file_record:
             raise HTTPException(status_code=404, detail="File not found")
@@ -778,62 +1536,134 @@ async def preview_file(file_id: int, current_user: dict = Depends(get_current_us
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/files")
-async def get_files(folder_id: int = 0, current_user: dict = Depends(get_current_user)):
-    db = load_db()
-    files = []
-    for f in db["files"]:
-        if f["folder_id"] == folder_id and not f.get("is_deleted", False):
-            file_copy = f.copy()
-            if 'content' in file_copy:
-                del file_copy['content']
-            files.append(file_copy)
-    return safe_json_encode(files)
+async def get_files(
+    folder_id: int = 0,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if limit is not None or after is not None:
+        limit, after_id = page_params(limit, after)
+        return keyset_page(store.list_files(folder_id=folder_id, is_deleted=False, after=after_id, limit=limit + 1), limit)
+    
+    return file_json(store.list_files(folder_id=folder_id, is_deleted=False))
 
 @app.get("/api/files/search")
 async def search_files(
     query: str = Query(..., min_length=1),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    db = load_db()
-    results = []
-    for f in db["files"]:
-        if not f.get("is_deleted", False) and query.lower() in f["name"].lower():
-            file_copy = f.copy()
-            if 'content' in file_copy:
-                del file_copy['content']
-            results.append(file_copy)
-    return safe_json_encode(results)
+    if limit is None and after is None:
+        return file_json(record for _, record in store.search_files(query, limit=SEARCH_RESULT_LIMIT))
+    
+    # Search pages are ordered by (rank, id), so the cursor carries both
+    limit = limit or DEFAULT_PAGE_SIZE
+    after_key = decode_cursor(after) if after else None
+    if after_key is not None and not (
+        isinstance(after_key, list) and len(after_key) == 2 and all(isinstance(k, int) for k in after_key)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    hits = store.search_files(query, limit=limit + 1, after=after_key)
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+    return {
+        "items": file_json(record for _, record in hits),
+        "next_cursor": encode_cursor([hits[-1][0], hits[-1][1]["id"]]) if has_more else None
+    }
 
 @app.get("/api/files/recent")
 async def get_recent_files(current_user: dict = Depends(get_current_user)):
-    db = load_db()
-    cutoff_time = datetime.now() - timedelta(minutes=30)
+    cutoff = timestamp_us((datetime.now() - timedelta(minutes=30)).isoformat())
     
+    # created_at is kept as epoch microseconds, so compare those directly
     recent_files = []
-    for f in db["files"]:
-        if not f.get("is_deleted", False):
-            try:
-                file_time = datetime.fromisoformat(f["created_at"])
-                if file_time > cutoff_time:
-                    file_copy = f.copy()
-                    if 'content' in file_copy:
-                        del file_copy['content']
-                    recent_files.append(file_copy)
-            except:
-                pass
+    for f in store.list_files(is_deleted=False):
+        created = f.created_us if isinstance(f.created_us, int) else timestamp_us(f.get("created_at"))
+        if created is not None and created > cutoff:
+            recent_files.append((created, f))
     
-    recent_files.sort(key=lambda x: x["created_at"], reverse=True)
-    return safe_json_encode(recent_files[:10])
+    recent_files.sort(key=lambda item: item[0], reverse=True)
+    return file_json(f for _, f in recent_files[:10])
 
-@app.get("/api/download/{file_id}")
-async def download_file(file_id: int, current_user: dict = Depends(get_current_user)):
-    db = load_db()
+def parse_byte_ranges(header, size):
+    """[start, end) pairs asked for by a Range header, or None to send the whole file
+
+    Malformed headers, other units and too many ranges are ignored, as RFC
+    7233 allows; a header none of whose ranges fall inside the file is
+    answered with 416.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    specs = [part.strip() for part in spec.split(",")]
+    if not specs or len(specs) > MAX_BYTE_RANGES:
+        return None
     
-    file_record = None
-    for f in db["files"]:
-        if f["id"] == file_id and not f.get("is_deleted", False):
-            file_record = f
-            break
+    ranges = []
+    for part in specs:
+        match = re.fullmatch(r"(\d*)-(\d*)", part)
+        if not match or match.groups() == ("", ""):
+            return None
+        first, last = match.groups()
+        if not first:
+            # bytes=-500 is the last 500 bytes
+            start, end = max(0, size - int(last)), size
+            if int(last) == 0:
+                continue
+        else:
+            start = int(first)
+            end = size if not last else int(last) + 1
+            if last and end <= start:
+                return None
+            end = min(end, size)
+        if start < size:
+            ranges.append((start, end))
+    
+    if not ranges:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return ranges
+
+def byte_range_parts(ranges, size, content_type, boundary):
+    """Part headers of a multipart/byteranges body, and the body's total length"""
+    heads = [
+        f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+        f"Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n".encode()
+        for start, end in ranges
+    ]
+    tail = f"--{boundary}--\r\n".encode()
+    length = sum(len(head) + end - start + 2 for head, (start, end) in zip(heads, ranges)) + len(tail)
+    return heads, tail, length
+
+async def iter_byte_ranges(ranges, heads, tail, read_range):
+    """Body of a multipart/byteranges response"""
+    for head, (start, end) in zip(heads, ranges):
+        yield head
+        chunks = read_range(start, end)
+        if hasattr(chunks, "__aiter__"):
+            async for chunk in chunks:
+                yield chunk
+        else:
+            for chunk in chunks:
+                yield chunk
+        yield b"\r\n"
+    yield tail
+
+@app.get("/api/download/{file_id}")
+async def download_file(
+    file_id: int,
+    range_header: str = Header(None, alias="Range"),
+    current_user: dict = Depends(get_current_user)
+):
+    file_record = get_live_file(file_id)
     
     if not file_record:
         raise HTTPException(status_code=404, detail="File not found")
@@ -842,31 +1672,47 @@ async def download_file(file_id: int, current_user: dict = Depends(get_current_u
         print(f"Downloading file: {file_record['name']}")
         
         file_bytes = None
-        
-        # Try stored content first
-        if file_record.get('content'):
-            try:
-                file_bytes = bytes.fromhex(file_record['content'])
-                print(f"Retrieved file from database storage")
-            except Exception as e:
-                print(f"Error retrieving from database: {e}")
-        
-        # Try Telegram
-        if not file_bytes:
+        blob_size = None
+        messages = None
+        message_session = None
+        
+        # Try the blob store first - read lazily while streaming
+        blob = file_record.get('blob')
+        if blob and blobs.exists(blob):
+            blob_size = blobs.size(blob)
+            print("Retrieved file from blob store")
+        
+        # Legacy inline content the background migration has not reached yet
+        elif file_record.get("content"):
+            file_bytes = await asyncio.to_thread(decode_inline_content, file_record)
+        
+        # Try Telegram: one message, or several for files split into segments,
+        # streamed part by part as they arrive
+        elif file_record.get("segments") or file_record.get("telegram_file_id"):
             try:
                 group_id = file_record["telegram_group_id"]
-                message_id = file_record["telegram_file_id"]
+                segments = file_record.get("segments") or [{"telegram_file_id": file_record["telegram_file_id"]}]
                 
-                if not message_id.startswith('local_'):
-                    message = await client.get_messages(int(group_id), ids=int(message_id))
-                    if message:
-                        file_bytes = await client.download_media(message.media, file=bytes)
-                        print(f"Retrieved file from Telegram")
+                if not str(segments[0]["telegram_file_id"]).startswith('local_'):
+                    async with telegram_session(group_id) as connected:
+                        ids = [int(segment["telegram_file_id"]) for segment in segments]
+                        messages = await connected.get_messages(await resolve_group(group_id, connected), ids=ids)
+                        if not all(message and message.file for message in messages):
+                            raise ValueError("a message is missing")
+                    # Messages are fetched per account, so the same session downloads them
+                    message_session = connected.pool_session
+                    print(f"Streaming {len(ids)} message(s) from Telegram")
+            except HTTPException:
+                # Telegram is warming up or every session is busy: the
+                # client should retry, not get (and cache) the fallback
+                raise
             except Exception as e:
+                messages = None
                 print(f"Error retrieving from Telegram: {e}")
         
         # Generate demo content if nothing else works
-        if not file_bytes:
+        demo = blob_size is None and not messages and file_bytes is None
+        if demo:
             file_content = f"Demo content for {file_record['name']}\nFile ID: {file_id}\nSize: {file_record['size']} bytes\nCreated: {file_record['created_at']}"
             file_bytes = file_content.encode('utf-8')
             print(f"Generated demo content")
@@ -883,11 +1729,18 @@ async def download_file(file_id: int, current_user: dict = Depends(get_current_u
             elif filename.endswith(('.mp3', '.wav', '.ogg')):
                 content_type = f"audio/{filename.split('.')[-1]}"
         
+        size = (
+            blob_size if blob_size is not None
+            else sum(message.file.size for message in messages) if messages
+            else len(file_bytes)
+        )
+        ranges = parse_byte_ranges(range_header, size)
+        
         headers = {
             "Content-Type": content_type,
-            "Content-Length": str(len(file_bytes)),
+            "Content-Length": str(size),
             "Accept-Ranges": "bytes",
-            "Cache-Control": "public, max-age=3600",
+            "Cache-Control": "no-store" if demo else "public, max-age=3600",
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Headers": "*"
         }
@@ -897,8 +1750,41 @@ async def download_file(file_id: int, current_user: dict = Depends(get_current_u
             safe_filename = sanitize_filename(file_record["name"])
             headers["Content-Disposition"] = f'attachment; filename="{safe_filename}"'
         
-        return Response(content=file_bytes, headers=headers)
+        def read_range(start, end):
+            # Telegram is asked only for the parts covering [start, end)
+            if blob_size is not None:
+                return blobs.iter_chunks(blob, start, end)
+            if messages:
+                return iter_segments(
+                    message_session.client, messages, start, end - start,
+                    parallel=TELEGRAM_SEGMENT_PARALLELISM,
+                    ahead=TELEGRAM_DOWNLOAD_AHEAD
+                )
+            return iter([file_bytes[start:end]])
+        
+        status_code = 200
+        if not ranges:
+            body = read_range(0, size)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+            headers["Content-Length"] = str(end - start)
+            body = read_range(start, end)
+        else:
+            boundary = uuid.uuid4().hex
+            heads, tail, length = byte_range_parts(ranges, size, content_type, boundary)
+            status_code = 206
+            headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+            headers["Content-Length"] = str(length)
+            body = iter_byte_ranges(ranges, heads, tail, read_range)
         
+        if messages:
+            body = stream_leased(message_session, body)
+        return StreamingResponse(body, status_code=status_code, headers=headers)
+        
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Download error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -913,31 +1799,22 @@ async def move_file(
         data = await request.json()
         target_folder_id = data.get('folder_id', 0)
         
-        db = load_db()
-        
-        file_record = None
-        for f in db["files"]:
-            if f["id"] == file_id and not f.get("is_deleted", False):
-                file_record = f
-                break
+        file_record = get_live_file(file_id)
         
         if not file_record:
             raise HTTPException(status_code=404, detail="File not found")
         
         # Verify target folder exists (if not root)
         if target_folder_id != 0:
-            folder_exists = any(
-                folder["id"] == target_folder_id and not folder.get("is_deleted", False)
-                for folder in db["folders"]
-            )
-            if not folder_exists:
+            folder = store.get_folder(target_folder_id)
+            if not folder or folder.get("is_deleted", False):
                 raise HTTPException(status_code=404, detail="Target folder not found")
         
         old_folder_id = file_record["folder_id"]
         file_record["folder_id"] = target_folder_id
         file_record["moved_at"] = datetime.now().isoformat()
         
-        save_db(db)
+        store.put_file(file_record)
         
         return {
             "message": "File moved successfully",
@@ -957,13 +1834,11 @@ async def create_folder(
     current_user: dict = Depends(get_current_user)
 ):
     try:
-        db = load_db()
-        
         clean_name = sanitize_filename(name)
         print(f"Creating folder: {clean_name}")
         
         folder_record = {
-            "id": db["next_id"],
+            "id": store.allocate_id(),
             "name": clean_name,
             "parent_id": parent_id,
             "created_by": current_user['user_id'],
@@ -971,32 +1846,29 @@ async def create_folder(
             "is_deleted": False
         }
         
-        db["folders"].append(folder_record)
-        db["next_id"] += 1
-        save_db(db)
-        
-        return safe_json_encode(folder_record)
+        return store.put_folder(folder_record)
         
     except Exception as e:
         print(f"Create folder error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/folders")
-async def get_folders(parent_id: int = 0, current_user: dict = Depends(get_current_user)):
-    db = load_db()
-    folders = [f for f in db["folders"] if f["parent_id"] == parent_id and not f.get("is_deleted", False)]
-    return safe_json_encode(folders)
+async def get_folders(
+    parent_id: int = 0,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if limit is not None or after is not None:
+        limit, after_id = page_params(limit, after)
+        return keyset_page(store.list_folders(parent_id=parent_id, is_deleted=False, after=after_id, limit=limit + 1), limit, list)
+    
+    return store.list_folders(parent_id=parent_id, is_deleted=False)
 
 @app.delete("/api/files/{file_id}")
 async def delete_file(file_id: int, current_user: dict = Depends(get_current_user)):
     try:
-        db = load_db()
-        
-        file_record = None
-        for f in db["files"]:
-            if f["id"] == file_id and not f.get("is_deleted", False):
-                file_record = f
-                break
+        file_record = get_live_file(file_id)
         
         if not file_record:
             raise HTTPException(status_code=404, detail="File not found")
@@ -1004,7 +1876,7 @@ async def delete_file(file_id: int, current_user: dict = Depends(get_current_use
         # Mark as deleted in database (soft delete)
         file_record["is_deleted"] = True
         file_record["deleted_at"] = datetime.now().isoformat()
-        save_db(db)
+        store.put_file(file_record)
         
         return {"message": "File moved to bin successfully"}
         
@@ -1012,29 +1884,72 @@ async def delete_file(file_id: int, current_user: dict = Depends(get_current_use
         print(f"Delete file error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# NEW: Permanently delete file endpoint
+@app.delete("/api/files/{file_id}/permanent")
+async def permanently_delete_file(file_id: int, current_user: dict = Depends(get_current_user)):
+    try:
+        file_record = store.get_file(file_id)
+        
+        if not file_record:
+            raise HTTPException(status_code=404, detail="File not found")
+        
+        if file_id in purging_files:
+            raise HTTPException(status_code=409, detail="File is already being deleted")
+        
+        # Copies and duplicate uploads share the Telegram messages and blob,
+        # which are only removed with the last file referencing them. The
+        # messages go first: if Telegram fails, the record stays and the
+        # delete can be retried rather than orphaning them.
+        unshared = [key for key in storage_keys(file_record) if store.storage_refcount(key) <= 1]
+        purging_files.add(file_id)
+        try:
+            for key in unshared:
+                if key[0] != "telegram":
+                    continue
+                try:
+                    with priority(BACKGROUND):
+                        async with telegram_session(key[1]) as connected:
+                            await connected.delete_messages(await resolve_group(key[1], connected), [int(message_id) for message_id in key[2]])
+                    print("File deleted from Telegram")
+                except HTTPException:
+                    raise
+                except Exception as e:
+                    print(f"Error deleting from Telegram: {e}")
+                    raise HTTPException(status_code=502, detail=f"Could not delete the file from Telegram: {e}")
+            
+            store.delete_file(file_id)
+        finally:
+            purging_files.discard(file_id)
+        
+        for key in unshared:
+            if key[0] == "blob" and not store.storage_refcount(key):
+                blobs.delete(key[1])
+        
+        return {"message": "File permanently deleted"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Permanent delete error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.delete("/api/folders/{folder_id}")
 async def delete_folder(folder_id: int, current_user: dict = Depends(get_current_user)):
     try:
-        db = load_db()
-        
-        folder_record = None
-        for f in db["folders"]:
-            if f["id"] == folder_id and not f.get("is_deleted", False):
-                folder_record = f
-                break
+        folder_record = store.get_folder(folder_id)
         
-        if not folder_record:
+        if not folder_record or folder_record.get("is_deleted", False):
             raise HTTPException(status_code=404, detail="Folder not found")
         
         # Delete all files in the folder
-        for file_record in db["files"]:
-            if file_record["folder_id"] == folder_id and not file_record.get("is_deleted", False):
-                file_record["is_deleted"] = True
+        for file_record in store.list_files(folder_id=folder_id, is_deleted=False):
+            file_record["is_deleted"] = True
+            store.put_file(file_record)
         
         # Mark folder as deleted
         folder_record["is_deleted"] = True
         folder_record["deleted_at"] = datetime.now().isoformat()
-        save_db(db)
+        store.put_folder(folder_record)
         
         return {"message": "Folder deleted successfully"}
         
@@ -1042,47 +1957,79 @@ async def delete_folder(folder_id: int, current_user: dict = Depends(get_current
         print(f"Delete folder error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/files/all")
-async def get_all_files(current_user: dict = Depends(get_current_user)):
-    db = load_db()
-    files = []
-    for f in db["files"]:
-        file_copy = f.copy()
-        if 'content' in file_copy:
-            del file_copy['content']
-        files.append(file_copy)
-    return safe_json_encode(files)
+async def export_files_ndjson():
+    """Yield every file record as one JSON line, a batch at a time"""
+    after_id = None
+    while True:
+        batch = store.list_files(after=after_id, limit=EXPORT_BATCH_SIZE)
+        if not batch:
+            break
+        # Re-seek by id for every batch, so records added or removed while
+        # the export is running never break the iteration
+        after_id = batch[-1]["id"]
+        yield "".join(json.dumps(record_json(f), ensure_ascii=False) + "\n" for f in batch)
+        await asyncio.sleep(0)
 
-@app.get("/api/storage/info")
-async def get_storage_info(current_user: dict = Depends(get_current_user)):
-    db = load_db()
-    files = [f for f in db["files"] if not f.get("is_deleted", False)]
+@app.get("/api/files/all")
+async def get_all_files(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    if format == "ndjson":
+        # Full-library dump for backup/reconciliation jobs, in constant memory
+        return StreamingResponse(export_files_ndjson(), media_type="application/x-ndjson")
     
-    total_size = sum(f.get("size", 0) for f in files)
-    total_files = len(files)
+    if limit is not None or after is not None:
+        limit, after_id = page_params(limit, after)
+        return keyset_page(store.list_files(after=after_id, limit=limit + 1), limit)
     
+    return file_json(store.list_files())
+
+def usage_json(totals):
+    total_size, total_files = totals
     return {
         "totalSize": total_size,
         "totalFiles": total_files,
         "formattedSize": format_file_size(total_size)
     }
-@app.on_event("startup")
-async def startup_event():
+
+@app.get("/api/storage/info")
+async def get_storage_info(folder_id: Optional[int] = None, current_user: dict = Depends(get_current_user)):
+    """Usage overall, of the current user and optionally of one folder, from running totals"""
+    info = usage_json(store.storage_totals())
+    info["user"] = usage_json(store.storage_totals(user_id=current_user['user_id']))
+    if folder_id is not None:
+        info["folder"] = {"folder_id": folder_id, **usage_json(store.storage_totals(folder_id=folder_id))}
+    return info
+
+@app.get("/api/storage/check")
+async def check_storage_counters(current_user: dict = Depends(get_current_user)):
+    """Recompute storage counters from scratch and report any drift"""
+    try:
+        return store.check_usage(repair=False)
+    except Exception as e:
+        print(f"Storage check error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/storage/check")
+async def repair_storage_counters(current_user: dict = Depends(get_current_user)):
+    """Recompute storage counters from scratch and repair any drift"""
     try:
-        await init_telegram()
-        migrate_database()
-        print("Application started successfully")
+        report = store.check_usage(repair=True)
+        if not report["consistent"]:
+            print(f"Storage counters were inconsistent and have been repaired: {report['mismatches']}")
+        return report
     except Exception as e:
-        print(f"Startup warning: {e}")
-        # Don't crash the app if Telegram client fails
-        migrate_database()
+        print(f"Storage check error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/debug/files")
 async def debug_files(current_user: dict = Depends(get_current_user)):
     """Debug endpoint to check file structure"""
     try:
-        db = load_db()
-        files = db.get("files", [])
+        files = store.list_files()
         
         debug_info = {
             "total_files": len(files),
@@ -0,0 +1,882 @@
+# metadata_store.py - SQLite metadata engine for TGDrive
+import os
+import json
+import shutil
+import sqlite3
+import threading
+from itertools import islice
+from bisect import bisect_left, bisect_right
+from search_index import NameIndex
+from file_record import FileRecord
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    folder_id INTEGER NOT NULL DEFAULT 0,
+    uploaded_by INTEGER,
+    name TEXT NOT NULL DEFAULT '',
+    size INTEGER NOT NULL DEFAULT 0,
+    starred INTEGER NOT NULL DEFAULT 0,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT,
+    clean INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_folder ON files (folder_id, is_deleted);
+CREATE INDEX IF NOT EXISTS idx_files_deleted ON files (is_deleted);
+CREATE INDEX IF NOT EXISTS idx_files_starred ON files (starred, is_deleted);
+
+CREATE TABLE IF NOT EXISTS folders (
+    id INTEGER PRIMARY KEY,
+    parent_id INTEGER NOT NULL DEFAULT 0,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
+    clean INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_folders_parent ON folders (parent_id, is_deleted);
+
+CREATE TABLE IF NOT EXISTS users (
+    id PRIMARY KEY,
+    clean INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+TABLES = ("files", "folders", "users")
+
+# Field holding the containing folder, per table with a children index
+PARENT_FIELDS = {"files": "folder_id", "folders": "parent_id"}
+
+# Compact in-memory type per table; the rest stay plain dicts
+RECORD_TYPES = {"files": FileRecord}
+
+
+def storage_keys(record):
+    """What holds a file's bytes: its Telegram message(s) and/or its blob
+
+    Copies and duplicate uploads share these, so they are reference counted.
+    """
+    keys = []
+    segments = record.get("segments")
+    if segments:
+        message_ids = tuple(str(segment["telegram_file_id"]) for segment in segments)
+    else:
+        message_id = str(record.get("telegram_file_id") or "")
+        message_ids = (message_id,) if message_id.isdigit() else ()
+    if message_ids:
+        keys.append(("telegram", str(record.get("telegram_group_id")), message_ids))
+    if record.get("blob"):
+        keys.append(("blob", record["blob"]))
+    return tuple(keys)
+
+
+def _plain(record):
+    return record.to_dict() if isinstance(record, FileRecord) else record
+
+
+def _wrap(table, record):
+    record_type = RECORD_TYPES.get(table)
+    return record_type.from_dict(record) if record_type else record
+
+
+def _file_row(record, version):
+    return (
+        record["id"],
+        record.get("folder_id", 0),
+        record.get("uploaded_by"),
+        record.get("name", ""),
+        record.get("size", 0),
+        1 if record.get("starred", False) else 0,
+        1 if record.get("is_deleted", False) else 0,
+        record.get("created_at"),
+        1,
+        version,
+        json.dumps(record, ensure_ascii=False),
+    )
+
+
+def _folder_row(record, version):
+    return (
+        record["id"],
+        record.get("parent_id", 0),
+        1 if record.get("is_deleted", False) else 0,
+        1,
+        version,
+        json.dumps(record, ensure_ascii=False),
+    )
+
+
+# Rows are only ever written after encode(), so they are always stored clean=1
+def _user_row(record, version):
+    return (record["id"], 1, version, json.dumps(record, ensure_ascii=False))
+
+
+class SortedIds:
+    """Ascending list of ids, seekable for keyset pagination"""
+
+    def __init__(self):
+        self.ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def add(self, record_id):
+        ids = self.ids
+        # New records get the highest id, so this is almost always an append
+        if not ids or record_id > ids[-1]:
+            ids.append(record_id)
+            return
+        position = bisect_left(ids, record_id)
+        if position == len(ids) or ids[position] != record_id:
+            ids.insert(position, record_id)
+
+    def discard(self, record_id):
+        ids = self.ids
+        position = bisect_left(ids, record_id)
+        if position < len(ids) and ids[position] == record_id:
+            del ids[position]
+
+    def after(self, record_id=None):
+        """Iterate ids greater than record_id"""
+        ids = self.ids
+        position = 0 if record_id is None else bisect_right(ids, record_id)
+        while position < len(ids):
+            yield ids[position]
+            position += 1
+
+
+ROW_BUILDERS = {"files": _file_row, "folders": _folder_row, "users": _user_row}
+
+UPSERT_SQL = {
+    "files": "INSERT OR REPLACE INTO files "
+             "(id, folder_id, uploaded_by, name, size, starred, is_deleted, created_at, clean, version, data) "
+             "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "folders": "INSERT OR REPLACE INTO folders (id, parent_id, is_deleted, clean, version, data) "
+               "VALUES (?, ?, ?, ?, ?, ?)",
+    "users": "INSERT OR REPLACE INTO users (id, clean, version, data) VALUES (?, ?, ?, ?)",
+}
+
+
+class Migrations:
+    """Registry of record upgrade steps, keyed by the schema version they produce
+
+    Every row remembers the version it was written at. Rows from an older
+    version are upgraded the first time they are read or written, or by
+    MetadataStore.migrate_some() from a background task. Steps registered
+    with lazy=False (those doing I/O) are not run on reads; rows needing
+    one are served as they are until a write or migrate_some() gets to them.
+    """
+
+    def __init__(self, version=0):
+        self.version = version
+        self.steps = {table: {} for table in TABLES}
+        self.eager = {table: set() for table in TABLES}
+
+    def step(self, table, version, lazy=True):
+        """Decorator registering fn(record) to bring a record up to version"""
+        if not 0 < version <= self.version:
+            raise ValueError(f"Migration version {version} is outside 1..{self.version}")
+
+        def register(fn):
+            self.steps[table][version] = fn
+            if not lazy:
+                self.eager[table].add(version)
+            return fn
+        return register
+
+    def lazy(self, table, version):
+        """Whether a row at version can be upgraded while it is being read"""
+        return not any(version < target for target in self.eager[table])
+
+    def upgrade(self, table, record, version):
+        for target in sorted(self.steps[table]):
+            if version < target:
+                self.steps[table][target](record)
+        return record
+
+
+class MetadataStore:
+    """Files, folders and users held in memory, persisted to SQLite
+
+    The SQLite tables are a snapshot. Every mutation is appended to a
+    JSON-lines journal next to it and marks its row dirty; startup loads
+    the snapshot and replays the journal. Compaction folds the dirty rows
+    into the snapshot and starts a fresh journal, and is meant to run from
+    a background task once the journal passes compact_bytes, and on shutdown.
+    With defer_load the caller runs load() itself, e.g. off the event loop.
+    """
+
+    def __init__(self, path, encode=None, compact_bytes=4 * 1024 * 1024, journal_fsync=False,
+                 migrations=None, defer_load=False):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.old_journal_path = path + ".journal.old"
+        self.compact_bytes = compact_bytes
+        self.journal_fsync = journal_fsync
+        self.journal = None
+        # Normalizes a record once on the way in (e.g. safe_json_encode), so
+        # everything held in memory can be served as-is
+        self.encode = encode or (lambda record: record)
+        self.migrations = migrations or Migrations()
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._add_columns()
+        self.loaded = False
+        if not defer_load:
+            self.load()
+
+    def _add_columns(self):
+        # Databases created before the clean flag and row versions existed
+        for table in TABLES:
+            columns = [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+            for column in ("clean", "version"):
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+
+    def load(self):
+        """(Re)load the snapshot from SQLite and replay the journal"""
+        with self.lock:
+            # Each table is a dict keyed by id - the primary-key index
+            self.data = {}
+            self.dirty = {table: set() for table in TABLES}
+            self.deleted = {table: set() for table in TABLES}
+            self.meta_dirty = False
+            # id -> version, for rows written before the current schema version
+            self.outdated = {table: {} for table in TABLES}
+            self._reset_indexes()
+            for table in TABLES:
+                rows = {}
+                query = f"SELECT clean, version, data FROM {table} ORDER BY rowid"
+                for clean, version, data in self.conn.execute(query):
+                    record = json.loads(data)
+                    if not clean:
+                        # Written before sanitize-on-write, clean it once
+                        record = self.encode(record)
+                        self.dirty[table].add(record["id"])
+                    record = _wrap(table, record)
+                    rows[record["id"]] = record
+                    self._index_record(table, record)
+                    if version < self.migrations.version:
+                        self.outdated[table][record["id"]] = version
+                self.data[table] = rows
+            self.data["next_id"] = self._read_meta("next_id", 1)
+            self.schema_version = self._read_meta("schema_version", 0)
+
+            if self.journal:
+                self.journal.close()
+            # A leftover .old journal means a compaction did not finish
+            replayed = self._replay(self.old_journal_path) + self._replay(self.journal_path)
+            if replayed:
+                print(f"Replayed {replayed} journal entries")
+            self._open_journal()
+            self.loaded = True
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.journal.close()
+            self.conn.close()
+
+    # Journal
+
+    def _open_journal(self):
+        self.journal = open(self.journal_path, 'a', encoding='utf-8')
+        self.journal_bytes = self.journal.tell()
+
+    def _append(self, event):
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        self.journal.write(line)
+        self.journal.flush()
+        if self.journal_fsync:
+            os.fsync(self.journal.fileno())
+        self.journal_bytes += len(line)
+
+    def _replay(self, journal_path):
+        if not os.path.exists(journal_path):
+            return 0
+
+        applied = 0
+        good_bytes = 0
+        with open(journal_path, 'rb') as f:
+            for raw in f:
+                try:
+                    event = json.loads(raw)
+                except ValueError:
+                    # Torn write from a crash - everything before it is intact
+                    break
+                self._apply(event)
+                good_bytes += len(raw)
+                applied += 1
+
+        if good_bytes < os.path.getsize(journal_path):
+            print(f"Truncating damaged journal tail in {journal_path}")
+            with open(journal_path, 'r+b') as f:
+                f.truncate(good_bytes)
+        return applied
+
+    def _apply(self, event):
+        op = event["op"]
+        if op == "put":
+            record = event["record"]
+            if not event.get("clean"):
+                record = self.encode(record)
+            self._put_row(event["table"], _wrap(event["table"], record))
+            self._set_version(event["table"], record["id"], event.get("version", 0))
+        elif op == "delete":
+            self._delete_row(event["table"], event["id"])
+        elif op == "next_id":
+            self.data["next_id"] = max(self.data["next_id"], event["value"])
+            self.meta_dirty = True
+
+    def _rotate_journal(self):
+        self.journal.close()
+        if os.path.exists(self.old_journal_path):
+            # A previous compaction failed, keep its entries in front
+            with open(self.journal_path, 'rb') as src, open(self.old_journal_path, 'ab') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.journal_path)
+        else:
+            os.replace(self.journal_path, self.old_journal_path)
+        self._open_journal()
+
+    # Compaction
+
+    def needs_compaction(self):
+        return self.journal_bytes >= self.compact_bytes
+
+    def is_dirty(self):
+        return self.meta_dirty or any(self.dirty.values()) or any(self.deleted.values())
+
+    def collect_dirty(self):
+        """Serialize pending changes into rows and reset the dirty sets"""
+        changes = {
+            "upserts": {}, "deletes": {}, "meta": {},
+            "ids": {table: (self.dirty[table], self.deleted[table]) for table in TABLES},
+            "meta_dirty": self.meta_dirty,
+        }
+        for table in TABLES:
+            if self.dirty[table]:
+                rows = self.data[table]
+                outdated = self.outdated[table]
+                changes["upserts"][table] = [
+                    ROW_BUILDERS[table](
+                        _plain(rows[record_id]), outdated.get(record_id, self.migrations.version)
+                    )
+                    for record_id in self.dirty[table] if record_id in rows
+                ]
+            if self.deleted[table]:
+                changes["deletes"][table] = [(record_id,) for record_id in self.deleted[table]]
+            self.dirty[table] = set()
+            self.deleted[table] = set()
+        if self.meta_dirty:
+            changes["meta"]["next_id"] = self.data["next_id"]
+            self.meta_dirty = False
+        if self.schema_version != self.migrations.version and not self.pending_migrations():
+            # Every row has been upgraded, stamp the database itself
+            changes["meta"]["schema_version"] = self.schema_version = self.migrations.version
+        return changes
+
+    def requeue(self, changes):
+        """Mark the rows of a failed write dirty again"""
+        for table, (dirty, deleted) in changes.get("ids", {}).items():
+            self.dirty[table] |= dirty - self.deleted[table]
+            self.deleted[table] |= deleted - self.dirty[table]
+        if changes.get("meta_dirty"):
+            self.meta_dirty = True
+        if "schema_version" in changes.get("meta", {}):
+            self.schema_version = None
+
+    def write_changes(self, changes):
+        """Apply rows from collect_dirty() to SQLite in one transaction"""
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                for table, rows in changes["deletes"].items():
+                    self.conn.executemany(f"DELETE FROM {table} WHERE id = ?", rows)
+                for table, rows in changes["upserts"].items():
+                    self.conn.executemany(UPSERT_SQL[table], rows)
+                for key, value in changes["meta"].items():
+                    self._write_meta(key, value)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def begin_compaction(self):
+        """Start a fresh journal and collect the rows the old one covers"""
+        with self.lock:
+            self._rotate_journal()
+            return self.collect_dirty()
+
+    def finish_compaction(self):
+        """Drop the old journal once its rows are in the snapshot"""
+        if os.path.exists(self.old_journal_path):
+            os.remove(self.old_journal_path)
+
+    def flush(self):
+        """Synchronously compact everything into the snapshot"""
+        if self.is_dirty() or self.journal_bytes:
+            self.write_changes(self.begin_compaction())
+            self.finish_compaction()
+
+    def _mark(self, table, record_id):
+        self.deleted[table].discard(record_id)
+        self.dirty[table].add(record_id)
+
+    # Meta / id allocation
+
+    def _read_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _write_meta(self, key, value):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, json.dumps(value))
+        )
+
+    def allocate_id(self):
+        """Reserve the next record id (shared by files and folders)"""
+        next_id = self.data["next_id"]
+        self.data["next_id"] = next_id + 1
+        self.meta_dirty = True
+        self._append({"op": "next_id", "value": next_id + 1})
+        return next_id
+
+    # Secondary indexes
+
+    def _reset_indexes(self):
+        # folder id -> SortedIds of its children, and the folder each child
+        # is currently filed under. Records are often mutated in place
+        # before put_*(), so the old parent comes from here.
+        self.children = {table: {} for table in PARENT_FIELDS}
+        self.parent_of = {table: {} for table in PARENT_FIELDS}
+        self.file_names = NameIndex()
+        # Id lists backing the unfiltered, bin and starred listings
+        self.file_ids = SortedIds()
+        self.deleted_file_ids = SortedIds()
+        self.starred_file_ids = SortedIds()
+        # Running [bytes, count] of live files, and what each file adds
+        self.usage_total = [0, 0]
+        self.usage_by_user = {}
+        self.usage_by_folder = {}
+        self.usage_of = {}
+        # sha256 -> ids of files with that content, and per storage key the
+        # number of files referencing it
+        self.file_hashes = {}
+        self.storage_refs = {}
+        self.content_of = {}
+        # Telegram messages still referenced, per storage group id
+        self.group_messages = {}
+
+    def _index_record(self, table, record):
+        if table == "files":
+            record_id = record["id"]
+            deleted = record.get("is_deleted", False)
+            self.file_ids.add(record_id)
+            if deleted:
+                self.deleted_file_ids.add(record_id)
+            else:
+                self.deleted_file_ids.discard(record_id)
+            if record.get("starred", False) and not deleted:
+                self.starred_file_ids.add(record_id)
+            else:
+                self.starred_file_ids.discard(record_id)
+            self.file_names.add(record_id, record.get("name", ""))
+            self._count_usage(record)
+            self._index_content(record)
+        self._index_parent(table, record)
+
+    def _unindex_record(self, table, record_id):
+        if table == "files":
+            self.file_ids.discard(record_id)
+            self.deleted_file_ids.discard(record_id)
+            self.starred_file_ids.discard(record_id)
+            self.file_names.remove(record_id)
+            self._uncount_usage(record_id)
+            self._unindex_content(record_id)
+        self._unindex_parent(table, record_id)
+
+    def _count_usage(self, record):
+        contribution = None
+        if not record.get("is_deleted", False):
+            contribution = (record.get("size", 0), record.get("uploaded_by"), record.get("folder_id", 0))
+        if self.usage_of.get(record["id"]) == contribution:
+            return
+        self._uncount_usage(record["id"])
+        if contribution:
+            self.usage_of[record["id"]] = contribution
+            self._add_usage(contribution, 1)
+
+    def _uncount_usage(self, record_id):
+        contribution = self.usage_of.pop(record_id, None)
+        if contribution:
+            self._add_usage(contribution, -1)
+
+    def _add_usage(self, contribution, sign):
+        size, user, folder = contribution
+        self.usage_total[0] += sign * size
+        self.usage_total[1] += sign
+        for counters, key in ((self.usage_by_user, user), (self.usage_by_folder, folder)):
+            counter = counters.setdefault(key, [0, 0])
+            counter[0] += sign * size
+            counter[1] += sign
+            if counter[1] == 0:
+                del counters[key]
+
+    def _index_content(self, record):
+        # Blob digests are SHA-256 too, so older local files take part in dedup
+        content = (record.get("sha256") or record.get("blob"), storage_keys(record))
+        if self.content_of.get(record["id"]) == content:
+            return
+        self._unindex_content(record["id"])
+        self.content_of[record["id"]] = content
+        digest, keys = content
+        if digest:
+            self.file_hashes.setdefault(digest, []).append(record["id"])
+        for key in keys:
+            self.storage_refs[key] = self.storage_refs.get(key, 0) + 1
+            if key[0] == "telegram" and self.storage_refs[key] == 1:
+                self.group_messages[key[1]] = self.group_messages.get(key[1], 0) + len(key[2])
+
+    def _unindex_content(self, record_id):
+        content = self.content_of.pop(record_id, None)
+        if not content:
+            return
+        digest, keys = content
+        if digest:
+            ids = self.file_hashes[digest]
+            ids.remove(record_id)
+            if not ids:
+                del self.file_hashes[digest]
+        for key in keys:
+            self.storage_refs[key] -= 1
+            if not self.storage_refs[key]:
+                del self.storage_refs[key]
+                if key[0] == "telegram":
+                    self.group_messages[key[1]] -= len(key[2])
+                    if not self.group_messages[key[1]]:
+                        del self.group_messages[key[1]]
+
+    def _index_parent(self, table, record):
+        field = PARENT_FIELDS.get(table)
+        if not field:
+            return
+        record_id = record["id"]
+        parent = record.get(field, 0)
+        parents = self.parent_of[table]
+        if record_id in parents:
+            if parents[record_id] == parent:
+                return
+            self._unindex_parent(table, record_id)
+        self.children[table].setdefault(parent, SortedIds()).add(record_id)
+        parents[record_id] = parent
+
+    def _unindex_parent(self, table, record_id):
+        if table not in PARENT_FIELDS or record_id not in self.parent_of[table]:
+            return
+        parent = self.parent_of[table].pop(record_id)
+        siblings = self.children[table][parent]
+        siblings.discard(record_id)
+        if not siblings:
+            del self.children[table][parent]
+
+    def _scan(self, table, ids, after=None, limit=None, accept=None):
+        """Records for ids greater than after, in id order, up to limit"""
+        if ids is None:
+            return []
+        rows = self.data[table]
+        results = []
+        for record_id in ids.after(after):
+            record = rows[record_id]
+            if accept is None or accept(record):
+                results.append(record)
+                if limit is not None and len(results) >= limit:
+                    break
+        # Upgraded after the walk, so the id lists are not changed under it
+        return [self._current(table, record) for record in results]
+
+    # Generic row access
+
+    def _get(self, table, record_id):
+        return self._current(table, self.data[table].get(record_id))
+
+    def _put_row(self, table, record):
+        self.data[table][record["id"]] = record
+        self._index_record(table, record)
+        self._mark(table, record["id"])
+
+    def _delete_row(self, table, record_id):
+        self.data[table].pop(record_id, None)
+        self.outdated[table].pop(record_id, None)
+        self._unindex_record(table, record_id)
+        self.dirty[table].discard(record_id)
+        self.deleted[table].add(record_id)
+
+    def _put(self, table, record):
+        """Upgrade, clean, store and journal a record; returns the stored version"""
+        record = _plain(record)
+        version = self.outdated[table].get(record["id"])
+        if version is not None:
+            record = self.migrations.upgrade(table, dict(record), version)
+        record = self.encode(record)
+        stored = _wrap(table, record)
+        self._put_row(table, stored)
+        self.outdated[table].pop(record["id"], None)
+        self._append({
+            "op": "put", "table": table, "record": record,
+            "clean": True, "version": self.migrations.version
+        })
+        return stored
+
+    # Schema migrations
+
+    def _set_version(self, table, record_id, version):
+        if version < self.migrations.version:
+            self.outdated[table][record_id] = version
+        else:
+            self.outdated[table].pop(record_id, None)
+
+    def _current(self, table, record, lazy=True):
+        """The record upgraded to the current schema version, if it is not already"""
+        if record is None or record["id"] not in self.outdated[table]:
+            return record
+        if lazy and not self.migrations.lazy(table, self.outdated[table][record["id"]]):
+            return record
+        try:
+            return self._put(table, record)
+        except Exception as e:
+            # Serve it as it is, the upgrade is retried on the next touch.
+            # Requeue it last so migrate_some() moves on to other rows.
+            print(f"Error migrating {table} record {record['id']}: {e}")
+            outdated = self.outdated[table]
+            outdated[record["id"]] = outdated.pop(record["id"])
+            return record
+
+    def pending_migrations(self):
+        return sum(len(ids) for ids in self.outdated.values())
+
+    def migrate_file(self, file_id):
+        """A file record with every step applied, including those not run on reads"""
+        return self._current("files", self.data["files"].get(file_id), lazy=False)
+
+    def next_outdated(self, limit):
+        """The records migrate_some(limit) will try next, to prepare them off the event loop"""
+        records = []
+        for table in TABLES:
+            rows = self.data[table]
+            records += [rows[record_id] for record_id in islice(self.outdated[table], limit - len(records))]
+            if len(records) >= limit:
+                break
+        return records
+
+    def migrate_some(self, limit):
+        """Try to upgrade up to limit outdated records; returns how many were upgraded"""
+        upgraded = 0
+        for table in TABLES:
+            rows = self.data[table]
+            outdated = self.outdated[table]
+            for record_id in list(islice(outdated, limit)):
+                self._current(table, rows[record_id], lazy=False)
+                upgraded += record_id not in outdated
+                limit -= 1
+            if limit <= 0:
+                break
+        return upgraded
+
+    def _delete(self, table, record_id):
+        self._delete_row(table, record_id)
+        self._append({"op": "delete", "table": table, "id": record_id})
+
+    # Users
+
+    def get_user(self, user_id):
+        return self._get("users", user_id)
+
+    def insert_user(self, record):
+        return self._put("users", record)
+
+    # Files
+
+    def get_file(self, file_id):
+        return self._get("files", file_id)
+
+    def put_file(self, record):
+        """Insert or update a single file row"""
+        return self._put("files", record)
+
+    def put_files(self, records):
+        for record in records:
+            self._put("files", record)
+
+    def delete_file(self, file_id):
+        self._delete("files", file_id)
+
+    def list_files(self, folder_id=None, is_deleted=None, starred=None, after=None, limit=None):
+        """Files in id order, optionally only those with an id above after"""
+        # Walk the narrowest id list that covers the filter
+        if folder_id is not None:
+            ids = self.children["files"].get(folder_id)
+        elif starred and is_deleted is False:
+            ids = self.starred_file_ids
+        elif is_deleted:
+            ids = self.deleted_file_ids
+        else:
+            ids = self.file_ids
+
+        def accept(record):
+            if is_deleted is not None and record.get("is_deleted", False) != is_deleted:
+                return False
+            if starred is not None and record.get("starred", False) != starred:
+                return False
+            return True
+
+        return self._scan("files", ids, after=after, limit=limit, accept=accept)
+
+    def search_files(self, query, limit=None, after=None):
+        """(rank, record) for live files whose name contains the query, best first"""
+        files = self.data["files"]
+        hits = self.file_names.search(
+            query, limit=limit, after=after,
+            accept=lambda file_id: not files[file_id].get("is_deleted", False)
+        )
+        return [(rank, self._current("files", files[file_id])) for rank, file_id in hits]
+
+    def files_with_hash(self, digest):
+        """Files, including binned ones, whose content has this SHA-256"""
+        files = self.data["files"]
+        return [files[file_id] for file_id in self.file_hashes.get(digest, ())]
+
+    def storage_refcount(self, key):
+        """How many files reference a key from storage_keys()"""
+        return self.storage_refs.get(key, 0)
+
+    def group_message_count(self, group_id):
+        """Telegram messages files still reference in a storage group"""
+        return self.group_messages.get(str(group_id), 0)
+
+    def storage_totals(self, user_id=None, folder_id=None):
+        """(bytes, file count) of live files, overall or for one user/folder"""
+        if user_id is not None:
+            return tuple(self.usage_by_user.get(user_id, (0, 0)))
+        if folder_id is not None:
+            return tuple(self.usage_by_folder.get(folder_id, (0, 0)))
+        return tuple(self.usage_total)
+
+    def check_usage(self, repair=True):
+        """Recompute the usage counters from scratch and compare"""
+        total = [0, 0]
+        by_user = {}
+        by_folder = {}
+        for record in self.data["files"].values():
+            if record.get("is_deleted", False):
+                continue
+            size = record.get("size", 0)
+            for counter in (total,
+                            by_user.setdefault(record.get("uploaded_by"), [0, 0]),
+                            by_folder.setdefault(record.get("folder_id", 0), [0, 0])):
+                counter[0] += size
+                counter[1] += 1
+
+        def diff(expected, actual):
+            return {
+                key: {"expected": expected.get(key, [0, 0]), "actual": actual.get(key, [0, 0])}
+                for key in set(expected) | set(actual)
+                if expected.get(key, [0, 0]) != actual.get(key, [0, 0])
+            }
+
+        mismatches = {
+            "users": diff(by_user, self.usage_by_user),
+            "folders": diff(by_folder, self.usage_by_folder),
+        }
+        if total != self.usage_total:
+            mismatches["total"] = {"expected": total, "actual": list(self.usage_total)}
+        consistent = not (mismatches.get("total") or mismatches["users"] or mismatches["folders"])
+
+        if not consistent and repair:
+            self.usage_total = total
+            self.usage_by_user = by_user
+            self.usage_by_folder = by_folder
+            self.usage_of = {
+                r["id"]: (r.get("size", 0), r.get("uploaded_by"), r.get("folder_id", 0))
+                for r in self.data["files"].values() if not r.get("is_deleted", False)
+            }
+
+        return {
+            "consistent": consistent,
+            "repaired": not consistent and repair,
+            "total": {"size": total[0], "files": total[1]},
+            "mismatches": mismatches,
+        }
+
+    def count_files(self):
+        return len(self.data["files"])
+
+    # Folders
+
+    def get_folder(self, folder_id):
+        return self._get("folders", folder_id)
+
+    def put_folder(self, record):
+        return self._put("folders", record)
+
+    def list_folders(self, parent_id=None, is_deleted=None, after=None, limit=None):
+        if parent_id is not None:
+            return self._scan(
+                "folders", self.children["folders"].get(parent_id), after=after, limit=limit,
+                accept=lambda r: is_deleted is None or r.get("is_deleted", False) == is_deleted
+            )
+        return [
+            self._current("folders", record) for record in list(self.data["folders"].values())
+            if is_deleted is None or record.get("is_deleted", False) == is_deleted
+        ]
+
+    # Legacy JSON import
+
+    def import_json_db(self, json_path):
+        """One-time import of an existing tgdrive_db.json into the tables"""
+        if self._read_meta("imported_from") or not os.path.exists(json_path):
+            return False
+
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        files = data.get("files", [])
+        folders = data.get("folders", [])
+        users = data.get("users", [])
+        highest_id = max([r["id"] for r in files + folders] or [0])
+
+        self.flush()
+        self.write_changes({
+            "upserts": {
+                # Legacy rows start at version 0 and are migrated like any other
+                "users": [_user_row(self.encode(r), 0) for r in users],
+                "folders": [_folder_row(self.encode(r), 0) for r in folders],
+                "files": [_file_row(self.encode(r), 0) for r in files],
+            },
+            "deletes": {},
+            "meta": {
+                "next_id": max(data.get("next_id", 1), highest_id + 1),
+                "imported_from": os.path.abspath(json_path),
+            },
+        })
+        self.load()
+
+        # Keep the original around, but out of the way
+        os.replace(json_path, json_path + ".imported")
+        print(f"Imported {len(files)} files, {len(folders)} folders and {len(users)} users from {json_path}")
+        return True
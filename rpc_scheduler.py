@@ -0,0 +1,118 @@
+# rpc_scheduler.py - Rate limits and priorities for the RPCs of one Telegram session
+import time
+import heapq
+import asyncio
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+INTERACTIVE = 0  # someone is waiting on it: downloads, previews
+BACKGROUND = 1  # bulk work: uploads, purges
+
+# Priority of the RPCs made by the current task and the tasks it starts
+rpc_priority = ContextVar("rpc_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(level):
+    token = rpc_priority.set(level)
+    try:
+        yield
+    finally:
+        rpc_priority.reset(token)
+
+
+class RpcScheduler:
+    """A token bucket with a priority queue in front of it
+
+    Calls wait in admit() for a token. Waiting interactive calls always go
+    before background ones, and background calls leave reserve tokens in
+    the bucket so an interactive burst finds them there. park() stops all
+    admissions until a flood wait is over.
+    """
+
+    def __init__(self, rate, burst, reserve=0):
+        self.rate = rate
+        self.burst = burst
+        self.reserve = min(reserve, burst - 1)
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.parked_until = 0
+        self.waiting = []  # (priority, seq, future)
+        self.seq = itertools.count()
+        self.wakeup = None  # set to wake the dispatcher before its delay is up
+        self.dispatcher = None
+        self.admitted = [0, 0]  # per priority
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _delay(self, level):
+        """Seconds before a call of this priority could be admitted, 0 if now"""
+        parked = self.parked_until - time.monotonic()
+        if parked > 0:
+            return parked
+        self._refill()
+        needed = 1 + (self.reserve if level == BACKGROUND else 0)
+        return max(0, (needed - self.tokens) / self.rate)
+
+    def _admit(self, level):
+        self.tokens -= 1
+        self.admitted[level] += 1
+
+    async def admit(self, level=None):
+        """Wait for a token; level defaults to the task's rpc_priority"""
+        level = rpc_priority.get() if level is None else level
+        if not self.waiting and self._delay(level) == 0:
+            self._admit(level)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (level, next(self.seq), future))
+        self._wake()
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch())
+        # Cancelled waiters are skipped by the dispatcher
+        await future
+
+    async def _dispatch(self):
+        while self.waiting:
+            level, _, future = self.waiting[0]
+            if future.done():
+                heapq.heappop(self.waiting)
+                continue
+            delay = self._delay(level)
+            if delay == 0:
+                heapq.heappop(self.waiting)
+                self._admit(level)
+                future.set_result(None)
+                continue
+            # Woken early when a more urgent call arrives or the queue is parked
+            self.wakeup = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self.wakeup, delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _wake(self):
+        if self.wakeup and not self.wakeup.done():
+            self.wakeup.set_result(None)
+
+    def park(self, seconds):
+        """Admit nothing for the next seconds, as Telegram asked"""
+        self.parked_until = max(self.parked_until, time.monotonic() + seconds)
+        self._wake()
+
+    def status(self):
+        self._refill()
+        waiting = [0, 0]
+        for level, _, future in self.waiting:
+            if not future.done():
+                waiting[level] += 1
+        return {
+            "tokens": round(self.tokens, 1),
+            "parked_for": max(0, round(self.parked_until - time.monotonic())),
+            "waiting": {"interactive": waiting[INTERACTIVE], "background": waiting[BACKGROUND]},
+            "admitted": {"interactive": self.admitted[INTERACTIVE], "background": self.admitted[BACKGROUND]}
+        }
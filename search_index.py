@@ -0,0 +1,117 @@
+# search_index.py - Incremental trigram/token index over file names
+import re
+import sys
+import heapq
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+SHORT = 2  # queries this short are ranked through word prefix postings
+
+
+def grams(text):
+    """The bigrams and trigrams of text"""
+    return {text[i:i + n] for n in (2, 3) for i in range(len(text) - n + 1)}
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def tokenize(text):
+    return set(TOKEN_RE.findall(text))
+
+
+class NameIndex:
+    """Substring and prefix search over names without scanning every record
+
+    Two and three character queries are a single bigram or trigram
+    lookup; longer ones intersect trigram postings and verify the
+    substring. A single character matches so much of the index that it
+    scans the names instead. The words of each name, and postings for
+    their one and two character prefixes, are kept at index time so
+    ranking never re-tokenizes a name.
+    """
+
+    def __init__(self):
+        self.names = {}         # id -> lowercased name
+        self.words = {}         # id -> tuple of the name's words
+        self.grams = {}         # bigram or trigram -> set of ids
+        self.prefixes = {}      # word prefix of 1-2 chars -> set of ids
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def _prefixes(words):
+        return {word[:n] for word in words for n in range(1, min(len(word), SHORT) + 1)}
+
+    def add(self, record_id, name):
+        name = (name or "").lower()
+        if self.names.get(record_id) == name:
+            return
+        self.remove(record_id)
+        # Interned, as the same words recur across many names
+        words = tuple(sys.intern(word) for word in tokenize(name))
+        self.names[record_id] = name
+        self.words[record_id] = words
+        for gram in grams(name):
+            self.grams.setdefault(gram, set()).add(record_id)
+        for prefix in self._prefixes(words):
+            self.prefixes.setdefault(prefix, set()).add(record_id)
+
+    def remove(self, record_id):
+        name = self.names.pop(record_id, None)
+        if name is None:
+            return
+        words = self.words.pop(record_id)
+        for postings, keys in ((self.grams, grams(name)), (self.prefixes, self._prefixes(words))):
+            for key in keys:
+                ids = postings[key]
+                ids.discard(record_id)
+                if not ids:
+                    del postings[key]
+
+    def _candidates(self, query):
+        if len(query) == 1:
+            return {i for i, name in self.names.items() if query in name}
+        if len(query) <= 3:
+            return self.grams.get(query, set())
+
+        postings = sorted((self.grams.get(g, set()) for g in trigrams(query)), key=len)
+        if not postings[0]:
+            return set()
+        ids = set(postings[0])
+        for other in postings[1:]:
+            ids &= other
+            if not ids:
+                break
+        return {i for i in ids if query in self.names[i]}
+
+    def rank(self, record_id, query):
+        """Lower is better: exact name, name prefix, word prefix, substring"""
+        name = self.names[record_id]
+        if name == query:
+            return 0
+        if name.startswith(query):
+            return 1
+        if len(query) <= SHORT:
+            word_prefix = record_id in self.prefixes.get(query, ())
+        else:
+            word_prefix = any(word.startswith(query) for word in self.words[record_id])
+        return 2 if word_prefix else 3
+
+    def search(self, query, limit=None, accept=None, after=None):
+        """Return up to limit (rank, id) pairs, best first
+
+        after is a (rank, id) key; only matches ranked after it are returned.
+        """
+        query = query.lower().strip()
+        if not query:
+            return []
+        after = tuple(after) if after is not None else None
+        matches = (
+            key for key in ((self.rank(i, query), i) for i in self._candidates(query))
+            if (after is None or key > after) and (accept is None or accept(key[1]))
+        )
+        if limit is None:
+            return sorted(matches)
+        return heapq.nsmallest(limit, matches)
@@ -0,0 +1,207 @@
+# telegram_pool.py - Several Telegram sessions shared by least-loaded dispatch
+import time
+import hashlib
+import asyncio
+from contextlib import asynccontextmanager
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+from telethon.sessions import StringSession
+from rpc_scheduler import RpcScheduler
+
+
+class PooledClient(TelegramClient):
+    """A TelegramClient whose RPCs go through its pool session's scheduler
+
+    Every RPC, including those made inside send_file() and download_media(),
+    goes through _call(), so this sees all of them. A flood wait parks the
+    session's queue and the call is retried once it is over, unless the
+    wait is longer than the pool's max_flood_wait.
+    """
+
+    def __init__(self, pool_session, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_session = pool_session
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        session = self.pool_session
+        while True:
+            await session.scheduler.admit()
+            session.calls += 1
+            try:
+                return await super()._call(sender, request, ordered, flood_sleep_threshold)
+            except FloodWaitError as e:
+                session.flooded(e.seconds)
+                if e.seconds > session.max_flood_wait:
+                    raise
+
+
+class PoolSession:
+    """One user session or bot in the pool, and how it is doing"""
+
+    def __init__(self, name, kind, credential, scheduler, max_flood_wait):
+        self.name = name
+        self.kind = kind  # "user" or "bot"
+        self.credential = credential
+        # Names follow configuration order; this stays with the account
+        self.key = hashlib.sha256(credential.encode()).hexdigest()[:16]
+        self.scheduler = scheduler
+        self.max_flood_wait = max_flood_wait
+        self.client = None
+        self.state = "connecting"
+        self.load = 0  # leases currently held
+        self.calls = 0
+        self.flood_until = 0
+        self.last_error = None
+        self.peers = {}  # channel id -> InputPeerChannel, access hashes are per account
+        self.unreachable = set()  # channel ids this account is not a member of
+
+    def flooded(self, seconds):
+        self.flood_until = max(self.flood_until, time.time() + seconds)
+        self.scheduler.park(seconds)
+        self.last_error = f"FloodWait {seconds}s"
+        print(f"Telegram session {self.name} hit a {seconds}s flood wait, taking it out of rotation")
+
+    def available(self):
+        return (
+            self.state == "connected"
+            and self.flood_until <= time.time()
+            and self.client.is_connected()
+        )
+
+    def status(self):
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "state": self.state if self.flood_until <= time.time() else "flood_wait",
+            "load": self.load,
+            "calls": self.calls,
+            "flood_wait": max(0, round(self.flood_until - time.time())),
+            "last_error": self.last_error,
+            "unreachable_groups": sorted(self.unreachable),
+            "rpc": self.scheduler.status()
+        }
+
+
+class TelegramPool:
+    """User sessions and bot tokens behind one least-loaded dispatcher
+
+    lease() hands out the connected session with the fewest leases in
+    flight. A session that hits FloodWait is skipped until the wait is over.
+    Each session's RPCs are limited to rate per second (bursts of up to
+    burst), with reserve tokens kept back for interactive calls.
+    """
+
+    def __init__(self, api_id, api_hash, sessions=(), bot_tokens=(), rate=30, burst=60, reserve=10, max_flood_wait=300):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        # Flood waits are handled by PooledClient, never slept through inside Telethon
+        self.flood_sleep_threshold = 0
+        credentials = [("user", s) for s in sessions] + [("bot", t) for t in bot_tokens]
+        self.sessions = []
+        for kind, credential in credentials:
+            name = f"{kind}{sum(1 for s in self.sessions if s.kind == kind) + 1}"
+            scheduler = RpcScheduler(rate, burst, reserve)
+            self.sessions.append(PoolSession(name, kind, credential, scheduler, max_flood_wait))
+
+    def __len__(self):
+        return len(self.sessions)
+
+    async def _connect(self, session):
+        if session.client:
+            # Left half-open by an earlier attempt
+            try:
+                await session.client.disconnect()
+            except Exception:
+                pass
+        try:
+            if session.kind == "bot":
+                session.client = PooledClient(
+                    session, StringSession(), self.api_id, self.api_hash,
+                    flood_sleep_threshold=self.flood_sleep_threshold
+                )
+                await session.client.start(bot_token=session.credential)
+            else:
+                session.client = PooledClient(
+                    session, StringSession(session.credential), self.api_id, self.api_hash,
+                    flood_sleep_threshold=self.flood_sleep_threshold
+                )
+                # connect() rather than start(), which would prompt for a login
+                await session.client.connect()
+                if not await session.client.is_user_authorized():
+                    raise RuntimeError("session string is not authorized")
+            session.state = "connected"
+        except Exception as e:
+            print(f"Telegram session {session.name} error: {e}")
+            session.state = "unavailable"
+            session.last_error = str(e)
+
+    async def connect(self):
+        """Connect every session not connected yet; returns how many are connected"""
+        await asyncio.gather(*(self._connect(session) for session in self.sessions if session.state != "connected"))
+        return sum(1 for session in self.sessions if session.state == "connected")
+
+    def mark_dropped(self):
+        """Sessions whose client went away after connecting, marked disconnected
+
+        Telethon retries a lost connection on its own a few times; once it
+        gives up, the session would still say "connected" without this.
+        """
+        dropped = [s for s in self.sessions if s.state == "connected" and not s.client.is_connected()]
+        for session in dropped:
+            print(f"Telegram session {session.name} lost its connection")
+            session.state = "disconnected"
+        return dropped
+
+    async def watch(self, interval):
+        """Check every interval seconds for dropped sessions; returns them once there are some"""
+        while True:
+            await asyncio.sleep(interval)
+            dropped = self.mark_dropped()
+            if dropped:
+                return dropped
+
+    async def disconnect(self):
+        for session in self.sessions:
+            if session.client:
+                try:
+                    await session.client.disconnect()
+                except Exception as e:
+                    print(f"Error disconnecting Telegram session {session.name}: {e}")
+
+    @property
+    def primary(self):
+        """The first connected user session; bots cannot create channels"""
+        for session in self.sessions:
+            if session.kind == "user" and session.state == "connected":
+                return session
+        return None
+
+    def pick(self, channel_id=None):
+        """The least-loaded available session that can reach channel_id, or None"""
+        candidates = [
+            session for session in self.sessions
+            if session.available() and channel_id not in session.unreachable
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda session: (session.load, session.calls))
+
+    def retry_after(self):
+        """Seconds until a flooded session is usable again, or None"""
+        waits = [s.flood_until - time.time() for s in self.sessions if s.state == "connected"]
+        return max(1, round(min(waits))) if waits else None
+
+    @asynccontextmanager
+    async def lease(self, session=None):
+        """Hold a session for one operation; LookupError if none is available"""
+        session = session or self.pick()
+        if session is None:
+            raise LookupError("No Telegram session is available")
+        session.load += 1
+        try:
+            yield session
+        finally:
+            session.load -= 1
+
+    def status(self):
+        return [session.status() for session in self.sessions]
@@ -0,0 +1,290 @@
+# telegram_transfer.py - Chunked file transfer to and from Telegram
+import os
+import asyncio
+import hashlib
+from telethon.errors import FloodWaitError
+from telethon.helpers import generate_random_long
+from telethon.network import MTProtoSender
+from telethon.tl.functions.upload import SaveBigFilePartRequest, SaveFilePartRequest
+from telethon.tl.types import InputFile, InputFileBig
+
+PART_SIZE = 512 * 1024  # the largest part Telegram accepts
+BIG_FILE_SIZE = 10 * 1024 * 1024  # above this, parts go through SaveBigFilePart
+PART_RETRIES = 3
+MAX_FLOOD_WAIT = 300  # longer flood waits fail the part instead of being slept through
+SEGMENT_SIZE = 4000 * PART_SIZE  # Telegram's per-document limit, 2000 MiB
+READ_SIZE = 1024 * 1024
+DOWNLOAD_PART_SIZE = 512 * 1024  # the largest GetFile request Telegram serves
+DOWNLOAD_AHEAD = 4  # parts buffered in front of a slow reader
+
+
+def part_count(size, part_size=PART_SIZE):
+    return max(1, (size + part_size - 1) // part_size)
+
+
+def segment_ranges(size, segment_size=SEGMENT_SIZE):
+    """(start, length) of each segment of a file split at segment_size"""
+    return [(start, min(segment_size, size - start)) for start in range(0, size, segment_size)]
+
+
+class FileSlice:
+    """Bytes [start, start + length) of a file, read with pread
+
+    Several slices of one file can be read at once, since none of them
+    moves the file position.
+    """
+
+    def __init__(self, fileobj, start, length):
+        self.fd = fileobj.fileno()
+        self.position = start
+        self.end = start + length
+
+    def read(self, size=-1):
+        remaining = self.end - self.position
+        size = remaining if size < 0 else min(size, remaining)
+        if size <= 0:
+            return b""
+        data = os.pread(self.fd, size, self.position)
+        self.position += len(data)
+        return data
+
+
+def hash_file(fileobj, size):
+    """SHA-256 of the first size bytes, without touching the file position"""
+    sha = hashlib.sha256()
+    reader = FileSlice(fileobj, 0, size)
+    while True:
+        chunk = reader.read(READ_SIZE)
+        if not chunk:
+            break
+        sha.update(chunk)
+    return sha.hexdigest()
+
+
+async def open_senders(client, count):
+    """Open count extra connections to the client's home DC
+
+    They share the session's auth key, so unlike connections to other DCs
+    no authorization has to be exported. Telethon has no public API for
+    this; it is what TelegramClient._create_exported_sender does.
+    """
+    dc = await client._get_dc(client.session.dc_id)
+    senders = []
+    try:
+        for _ in range(count):
+            sender = MTProtoSender(client.session.auth_key, loggers=client._log)
+            await sender.connect(client._connection(
+                dc.ip_address,
+                dc.port,
+                dc.id,
+                loggers=client._log,
+                proxy=client._proxy,
+                local_addr=client._local_addr
+            ))
+            senders.append(sender)
+    except Exception:
+        await close_senders(senders)
+        raise
+    return senders
+
+
+async def close_senders(senders):
+    for sender in senders:
+        try:
+            await sender.disconnect()
+        except Exception as e:
+            print(f"Error closing upload connection: {e}")
+
+
+async def send_with_retry(send, request, retries=PART_RETRIES, max_flood_wait=MAX_FLOOD_WAIT):
+    """Send one request, retrying errors and flood waits up to retries times
+
+    A flood wait longer than max_flood_wait fails at once.
+    """
+    attempt = 0
+    while True:
+        try:
+            return await send(request)
+        except FloodWaitError as e:
+            attempt += 1
+            if e.seconds > max_flood_wait or attempt > retries:
+                raise
+            await asyncio.sleep(e.seconds)
+        except Exception:
+            attempt += 1
+            if attempt > retries:
+                raise
+            await asyncio.sleep(0.5 * 2 ** attempt)
+
+
+async def upload_stream(client, fileobj, size, name, part_size=PART_SIZE, parallel=1, retries=PART_RETRIES,
+                        progress=None, max_flood_wait=MAX_FLOOD_WAIT):
+    """Send size bytes of fileobj to Telegram as file parts
+
+    The file is read and hashed in order. Parts of big files are sent by
+    parallel workers, each over its own connection when one can be opened.
+    At most about 2 * parallel parts are held in memory. Returns
+    (input_file, sha256 hex digest), where input_file can be passed to
+    client.send_file(). progress(n) is called as each part of n bytes is sent.
+    """
+    file_id = generate_random_long()
+    total_parts = part_count(size, part_size)
+    big = size > BIG_FILE_SIZE
+    parallel = max(1, min(parallel, total_parts)) if big else 1
+    sha = hashlib.sha256()
+    md5 = None if big else hashlib.md5()
+    parts = asyncio.Queue(maxsize=parallel * 2)
+
+    async def read_parts():
+        sent = 0
+        for part in range(total_parts):
+            chunk = await asyncio.to_thread(fileobj.read, part_size)
+            if len(chunk) != min(part_size, size - sent):
+                raise IOError(f"Upload of {name} ended at {sent + len(chunk)} of {size} bytes")
+            sha.update(chunk)
+            if md5:
+                md5.update(chunk)
+            await parts.put((part, chunk))
+            sent += len(chunk)
+        for _ in range(parallel):
+            await parts.put(None)
+
+    async def send_parts(send):
+        while True:
+            item = await parts.get()
+            if item is None:
+                return
+            part, chunk = item
+            if big:
+                request = SaveBigFilePartRequest(file_id, part, total_parts, chunk)
+            else:
+                request = SaveFilePartRequest(file_id, part, chunk)
+            await send_with_retry(send, request, retries, max_flood_wait)
+            if progress:
+                progress(len(chunk))
+
+    senders = []
+    if parallel > 1:
+        try:
+            senders = await open_senders(client, parallel)
+        except Exception as e:
+            # Still parallel, just multiplexed over the client's own connection
+            print(f"Could not open extra upload connections, sharing one: {e}")
+
+    # Through client._call like the client's own requests, so flood waits
+    # and errors are handled (and seen by subclasses) the same way
+    sends = [lambda request, sender=sender: client._call(sender, request) for sender in senders]
+    sends += [client] * (parallel - len(sends))
+    tasks = [asyncio.create_task(read_parts())] + [asyncio.create_task(send_parts(send)) for send in sends]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        await close_senders(senders)
+
+    if big:
+        return InputFileBig(file_id, total_parts, name), sha.hexdigest()
+    return InputFile(file_id, total_parts, name, md5.hexdigest()), sha.hexdigest()
+
+
+class DocumentReader:
+    """Bytes [start, start + length) of a document message, fetched from creation
+
+    Telegram serves files in aligned parts, so the range is widened to
+    DOWNLOAD_PART_SIZE boundaries and the extra head and tail are trimmed.
+    A producer task starts at once and keeps up to ahead parts in front of
+    the consumer, so memory stays at ahead * DOWNLOAD_PART_SIZE whatever the
+    file size. close() stops it.
+    """
+
+    def __init__(self, client, message, start=0, length=None, ahead=DOWNLOAD_AHEAD):
+        size = message.file.size
+        self.end = size if length is None else min(size, start + length)
+        self.offset = start - start % DOWNLOAD_PART_SIZE
+        self.skip = start - self.offset
+        self.remaining = max(0, self.end - start)
+        self.parts = asyncio.Queue(maxsize=ahead)
+        self.producer = None
+        if self.remaining:
+            self.producer = asyncio.create_task(self._produce(client, message, size))
+
+    async def _produce(self, client, message, size):
+        try:
+            async for part in client.iter_download(
+                message.media, offset=self.offset, request_size=DOWNLOAD_PART_SIZE,
+                limit=part_count(self.end - self.offset, DOWNLOAD_PART_SIZE), file_size=size
+            ):
+                await self.parts.put(part)
+            await self.parts.put(None)
+        except Exception as e:
+            await self.parts.put(e)
+
+    async def __aiter__(self):
+        while self.remaining > 0:
+            part = await self.parts.get()
+            if part is None:
+                break
+            if isinstance(part, Exception):
+                raise part
+            trimmed = part[self.skip:]
+            self.skip -= len(part) - len(trimmed)
+            trimmed = trimmed[:self.remaining]
+            self.remaining -= len(trimmed)
+            if trimmed:
+                yield trimmed
+
+    def close(self):
+        if self.producer:
+            self.producer.cancel()
+
+
+async def iter_document(client, message, start=0, length=None, ahead=DOWNLOAD_AHEAD):
+    """Yield bytes [start, start + length) of a document message as they arrive"""
+    reader = DocumentReader(client, message, start, length, ahead)
+    try:
+        async for part in reader:
+            yield part
+    finally:
+        reader.close()
+
+
+async def iter_segments(client, messages, start=0, length=None, parallel=2, ahead=DOWNLOAD_AHEAD):
+    """Yield bytes [start, start + length) of one or more document messages
+
+    The messages are taken as one file, in order, and only those overlapping
+    the range are fetched. While one streams, up to parallel - 1 of the
+    following ones already fetch their first ahead parts, so segments
+    follow each other without a gap while memory stays at
+    parallel * ahead * DOWNLOAD_PART_SIZE per stream.
+    """
+    end = sum(message.file.size for message in messages)
+    if length is not None:
+        end = min(end, start + length)
+    pieces = []  # (message, start within it, length)
+    base = 0
+    for message in messages:
+        size = message.file.size
+        if base < end and base + size > start:
+            piece_start = max(start, base) - base
+            pieces.append((message, piece_start, min(end, base + size) - base - piece_start))
+        base += size
+
+    readers = {}  # piece index -> reader already fetching it
+    try:
+        for index in range(len(pieces)):
+            for later in range(index, min(len(pieces), index + parallel)):
+                if later not in readers:
+                    readers[later] = DocumentReader(client, *pieces[later], ahead)
+            reader = readers.pop(index)
+            try:
+                async for part in reader:
+                    yield part
+            finally:
+                reader.close()
+    finally:
+        # The client went away or a segment failed: stop what was fetched ahead
+        for reader in readers.values():
+            reader.close()
@@ -0,0 +1,88 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+# main.py keeps its data files relative to the working directory
+WORK_DIR = tempfile.mkdtemp()
+os.chdir(WORK_DIR)
+os.environ["SESSION_STRING"] = ""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as c:
+        # The store loads in a startup task
+        c.portal.call(main.get_store)
+        yield c
+
+
+@pytest.fixture(scope="module")
+def headers():
+    token = main.create_jwt_token({"id": 7, "username": "u", "first_name": "U"})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def fallback_file(client):
+    """A record with neither a blob nor a Telegram message behind it"""
+    record = main.create_file_record(
+        "missing.bin", "application/octet-stream", 0, {"user_id": 7},
+        {"size": 10}
+    )
+    yield record
+    main.store.delete_file(record["id"])
+
+
+def test_fallback_download_has_a_body(client, headers, fallback_file):
+    r = client.get(f"/api/download/{fallback_file['id']}", headers=headers)
+    assert r.status_code == 200
+    assert r.content.startswith(b"Demo content for missing.bin")
+    assert int(r.headers["content-length"]) == len(r.content)
+
+
+def test_fallback_download_range(client, headers, fallback_file):
+    r = client.get(f"/api/download/{fallback_file['id']}", headers={**headers, "Range": "bytes=0-3"})
+    assert r.status_code == 206
+    assert r.content == b"Demo"
+    assert r.headers["content-range"].startswith("bytes 0-3/")
+
+
+def test_readiness_reports_metadata(client):
+    r = client.get("/api/health/ready")
+    assert r.status_code == 200
+    assert r.json()["metadata"] == "loaded"
+
+
+def test_parse_byte_ranges():
+    parse = main.parse_byte_ranges
+    assert parse(None, 10) is None
+    assert parse("bytes=0-3", 10) == [(0, 4)]
+    assert parse("bytes=6-", 10) == [(6, 10)]
+    assert parse("bytes=-4", 10) == [(6, 10)]
+    assert parse("bytes=-40", 10) == [(0, 10)]
+    assert parse("bytes=8-20", 10) == [(8, 10)]
+    assert parse("bytes=0-1, 4-5", 10) == [(0, 2), (4, 6)]
+    # Out-of-file ranges are dropped while any other range is satisfiable
+    assert parse("bytes=0-1,20-30", 10) == [(0, 2)]
+
+
+def test_parse_byte_ranges_ignores_bad_headers():
+    parse = main.parse_byte_ranges
+    assert parse("items=0-3", 10) is None
+    assert parse("bytes=a-3", 10) is None
+    assert parse("bytes=5-2", 10) is None
+    assert parse("bytes=-", 10) is None
+    assert parse("bytes=" + ",".join(["0-1"] * (main.MAX_BYTE_RANGES + 1)), 10) is None
+
+
+def test_parse_byte_ranges_unsatisfiable():
+    with pytest.raises(main.HTTPException) as e:
+        main.parse_byte_ranges("bytes=20-30", 10)
+    assert e.value.status_code == 416
+    assert e.value.headers["Content-Range"] == "bytes */10"
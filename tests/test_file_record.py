@@ -0,0 +1,68 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from file_record import FileRecord
+from search_index import NameIndex
+
+
+def test_file_record_round_trip():
+    data = {
+        "id": 4, "name": "report.pdf", "size": 10, "mime_type": "application/pdf",
+        "folder_id": 0, "uploaded_by": 7, "created_at": "2024-01-01T12:30:00.123456",
+        "is_deleted": False, "starred": True, "telegram_file_id": "55",
+        "telegram_group_id": -100123, "sha256": "ab" * 32,
+        "versions": [{"version": 1}], "moved_at": "2024-02-01T00:00:00",
+    }
+    record = FileRecord(data)
+    assert record.to_dict() == data
+    assert list(record) == list(data)
+    assert record.extra == {"versions": [{"version": 1}], "moved_at": "2024-02-01T00:00:00"}
+    assert FileRecord(record.to_dict()) == record
+
+
+def test_file_record_keeps_odd_timestamps_verbatim():
+    for created_at in ("2024-01-01T00:00:00+00:00", "yesterday", None):
+        record = FileRecord({"id": 1, "created_at": created_at})
+        assert record["created_at"] == created_at
+        assert record.to_dict() == {"id": 1, "created_at": created_at}
+
+
+def test_file_record_unset_is_not_none():
+    record = FileRecord({"id": 1, "blob": None})
+    assert record["blob"] is None
+    assert "sha256" not in record
+    assert record.get("sha256", "missing") == "missing"
+    del record["blob"]
+    assert "blob" not in record
+    copy = record.copy()
+    copy["name"] = "b.txt"
+    assert "name" not in record
+
+
+def test_name_index_search():
+    index = NameIndex()
+    index.add(1, "report.pdf")
+    index.add(2, "Annual Report 2024.docx")
+    index.add(3, "a")
+    assert index.search("df") == [(3, 1)]
+    assert index.search("REPORT") == [(1, 1), (2, 2)]
+    assert index.search("a") == [(0, 3), (1, 2)]
+    assert index.search("o") == [(3, 1), (3, 2)]
+    assert index.search("report", after=(1, 1)) == [(2, 2)]
+    assert index.search("zz") == []
+
+
+def test_name_index_add_remove_round_trip():
+    index = NameIndex()
+    index.add(1, "holiday photo.jpg")
+    index.add(2, "photo.png")
+    index.add(1, "notes.txt")
+    assert index.search("holi") == []
+    assert index.search("not") == [(1, 1)]
+
+    index.remove(1)
+    index.remove(2)
+    assert len(index) == 0
+    assert index.grams == {} and index.prefixes == {} and index.words == {}
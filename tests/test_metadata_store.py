@@ -0,0 +1,133 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metadata_store import MetadataStore
+
+
+def file_row(record_id, name="a.txt"):
+    return {
+        "id": record_id, "name": name, "size": 5, "mime_type": "text/plain",
+        "folder_id": 0, "uploaded_by": 7, "created_at": "2024-01-01T00:00:00",
+        "is_deleted": False, "starred": False,
+    }
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "tgdrive.db")
+
+
+def crash(store):
+    """Drop a store without compacting, as a killed process would"""
+    store.journal.close()
+    store.conn.close()
+
+
+def test_journal_replay(db_path):
+    store = MetadataStore(db_path)
+    store.put_file(file_row(1))
+    store.put_file(file_row(2, "b.txt"))
+    store.put_folder({"id": 3, "name": "Docs", "parent_id": 0, "created_by": 7, "is_deleted": False})
+    store.delete_file(1)
+    crash(store)
+
+    store = MetadataStore(db_path)
+    assert store.get_file(1) is None
+    assert store.get_file(2)["name"] == "b.txt"
+    assert store.get_folder(3)["name"] == "Docs"
+    assert [f["id"] for _, f in store.search_files("b.txt")] == [2]
+
+
+def test_torn_tail_is_truncated(db_path):
+    store = MetadataStore(db_path)
+    store.put_file(file_row(1))
+    good_bytes = store.journal_bytes
+    crash(store)
+    with open(db_path + ".journal", "a", encoding="utf-8") as f:
+        f.write('{"op": "put", "table": "files", "rec')
+
+    store = MetadataStore(db_path)
+    assert store.get_file(1)["name"] == "a.txt"
+    assert os.path.getsize(db_path + ".journal") == good_bytes
+
+    # Entries written after the truncation replay as usual
+    store.put_file(file_row(2, "b.txt"))
+    crash(store)
+    store = MetadataStore(db_path)
+    assert store.get_file(2)["name"] == "b.txt"
+
+
+def test_old_journal_from_failed_compaction(db_path):
+    store = MetadataStore(db_path)
+    store.put_file(file_row(1))
+    store.begin_compaction()
+    # The snapshot write never happens; later writes go to a fresh journal
+    store.put_file(file_row(2, "b.txt"))
+    assert os.path.exists(db_path + ".journal.old")
+    crash(store)
+
+    store = MetadataStore(db_path)
+    assert store.get_file(1)["name"] == "a.txt"
+    assert store.get_file(2)["name"] == "b.txt"
+
+    # The next compaction folds both journals into the snapshot
+    store.flush()
+    assert not os.path.exists(db_path + ".journal.old")
+    crash(store)
+    os.remove(db_path + ".journal")
+    store = MetadataStore(db_path)
+    assert store.get_file(1) is not None and store.get_file(2) is not None
+
+
+def test_requeue(db_path):
+    store = MetadataStore(db_path)
+    store.put_file(file_row(1))
+    store.put_file(file_row(2, "b.txt"))
+    changes = store.begin_compaction()
+    assert not store.is_dirty()
+
+    # Deleted while the failed write was in flight, so it must stay deleted
+    store.delete_file(2)
+    store.requeue(changes)
+    assert store.is_dirty()
+    store.flush()
+    crash(store)
+    os.remove(db_path + ".journal")
+
+    store = MetadataStore(db_path)
+    assert store.get_file(1)["name"] == "a.txt"
+    assert store.get_file(2) is None
+
+
+def test_ids_survive_restarts(db_path):
+    store = MetadataStore(db_path)
+    first = store.allocate_id()
+    second = store.allocate_id()
+    assert second == first + 1
+    crash(store)
+
+    # Replayed from the journal
+    store = MetadataStore(db_path)
+    third = store.allocate_id()
+    assert third > second
+    store.close()
+
+    # Read back from the snapshot
+    store = MetadataStore(db_path)
+    assert store.allocate_id() > third
+
+
+def test_deferred_load(db_path):
+    store = MetadataStore(db_path)
+    store.put_file(file_row(1))
+    crash(store)
+
+    store = MetadataStore(db_path, defer_load=True)
+    assert not store.loaded
+    store.load()
+    assert store.loaded
+    assert store.get_file(1)["name"] == "a.txt"
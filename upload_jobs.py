@@ -0,0 +1,157 @@
+# upload_jobs.py - Background queue for uploads on their way to Telegram
+import time
+import uuid
+import asyncio
+from datetime import datetime
+
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+
+class UploadJobs:
+    """A bounded queue of upload jobs drained by a few worker tasks
+
+    Each job is a dict with its progress (bytes_sent, status, result or
+    error); run(job) does the work and reports progress through
+    job["progress"]. Finished jobs are kept for ttl seconds so clients can
+    read their outcome. Jobs still queued or running when the queue is
+    stopped end up "interrupted" rather than "cancelled", so their cleanup
+    can keep what they need to be picked up again.
+    """
+
+    def __init__(self, maxsize, workers, ttl):
+        self.maxsize = maxsize
+        self.workers = workers
+        self.ttl = ttl
+        self.jobs = {}
+        self.queue = None
+        self.tasks = []
+        self.stopping = False
+
+    def start(self):
+        self.stopping = False
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Running jobs are interrupted by their worker as it is cancelled
+        self.stopping = True
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        while not self.queue.empty():
+            job, run, cleanup = self.queue.get_nowait()
+            if job["status"] == "queued":
+                self._finish(job, "interrupted")
+            self._cleanup(job, cleanup)
+
+    def submit(self, run, cleanup=None, **fields):
+        """Queue run(job); raises asyncio.QueueFull when the queue is full
+
+        cleanup(job) is called once the job has finished, whatever the outcome.
+        """
+        self.expire()
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "bytes_sent": 0,
+            "created_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            **fields
+        }
+        job["progress"] = lambda sent: self._advance(job, sent)
+        self.queue.put_nowait((job, run, cleanup))
+        self.jobs[job["id"]] = job
+        return job
+
+    def _advance(self, job, sent):
+        job["bytes_sent"] += sent
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job):
+        """Cancel a job; one that is running has its task cancelled mid-transfer
+
+        Returns False if the job had already finished.
+        """
+        if job["status"] == "queued":
+            self._finish(job, "cancelled")
+        elif job["status"] == "running":
+            job["task"].cancel()
+        else:
+            return False
+        return True
+
+    def _finish(self, job, status, result=None, error=None):
+        job["status"] = status
+        job["result"] = result
+        job["error"] = error
+        job["finished_at"] = time.time()
+        job.pop("task", None)
+
+    async def _work(self):
+        while True:
+            job, run, cleanup = await self.queue.get()
+            try:
+                if job["status"] != "queued":
+                    continue
+                job["status"] = "running"
+                job["started_at"] = time.time()
+                job["task"] = asyncio.create_task(run(job))
+                try:
+                    self._finish(job, "completed", result=await job["task"])
+                except asyncio.CancelledError:
+                    if self.stopping or not job["task"].cancelled():
+                        # The worker itself is being stopped
+                        job["task"].cancel()
+                        self._finish(job, "interrupted")
+                        raise
+                    self._finish(job, "cancelled")
+                except Exception as e:
+                    print(f"Upload job {job['id']} failed: {e}")
+                    self._finish(job, "failed", error=str(e))
+            finally:
+                if job["status"] == "running":
+                    job["task"].cancel()
+                    self._finish(job, "interrupted")
+                self._cleanup(job, cleanup)
+                self.queue.task_done()
+
+    def _cleanup(self, job, cleanup):
+        if cleanup:
+            try:
+                cleanup(job)
+            except Exception as e:
+                print(f"Error cleaning up upload job {job['id']}: {e}")
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [j["id"] for j in self.jobs.values() if j["finished_at"] and j["finished_at"] < cutoff]:
+            del self.jobs[job_id]
+
+    def info(self, job):
+        """The JSON shape of a job, with its throughput in bytes per second"""
+        throughput = 0
+        if job["started_at"]:
+            elapsed = (job["finished_at"] or time.time()) - job["started_at"]
+            throughput = round(job["bytes_sent"] / elapsed) if elapsed > 0 else 0
+        return {
+            "job_id": job["id"],
+            "name": job.get("name"),
+            "size": job.get("size"),
+            "status": job["status"],
+            "bytes_sent": job["bytes_sent"],
+            "throughput": throughput,
+            "queued_at": _isoformat(job["created_at"]),
+            "started_at": _isoformat(job["started_at"]),
+            "finished_at": _isoformat(job["finished_at"]),
+            "result": job["result"],
+            "error": job["error"]
+        }
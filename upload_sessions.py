@@ -0,0 +1,113 @@
+# upload_sessions.py - Resumable uploads staged on disk
+import os
+import re
+import json
+import time
+import uuid
+
+UPLOAD_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+
+class UploadSessions:
+    """Upload sessions staged on disk until they are finalized
+
+    Each session is <id>.json (what is being uploaded, and by whom) next to
+    <id>.part (the bytes received so far). The committed offset is the size
+    of the .part file, so sessions survive restarts.
+    """
+
+    def __init__(self, root, ttl):
+        self.root = root
+        self.ttl = ttl
+        self.busy = set()  # sessions with a chunk or finalize in flight
+        os.makedirs(root, exist_ok=True)
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.root, upload_id + ".json")
+
+    def part_path(self, upload_id):
+        return os.path.join(self.root, upload_id + ".part")
+
+    def _save(self, session):
+        fields = {k: v for k, v in session.items() if k != "offset"}
+        tmp_path = self._meta_path(session["id"]) + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(fields, f, ensure_ascii=False)
+        os.replace(tmp_path, self._meta_path(session["id"]))
+
+    def create(self, **fields):
+        now = time.time()
+        session = {"id": uuid.uuid4().hex, "created_at": now, "updated_at": now, **fields}
+        open(self.part_path(session["id"]), 'wb').close()
+        self._save(session)
+        session["offset"] = 0
+        return session
+
+    def get(self, upload_id):
+        if not UPLOAD_ID_RE.fullmatch(upload_id or ""):
+            return None
+        try:
+            with open(self._meta_path(upload_id), 'r', encoding='utf-8') as f:
+                session = json.load(f)
+            session["offset"] = os.path.getsize(self.part_path(upload_id))
+        except (FileNotFoundError, ValueError):
+            return None
+        return session
+
+    def touch(self, session):
+        session["updated_at"] = time.time()
+        self._save(session)
+
+    def claim(self, upload_id):
+        """Mark a session busy; False if another request already has it"""
+        if upload_id in self.busy:
+            return False
+        self.busy.add(upload_id)
+        return True
+
+    def release(self, upload_id):
+        self.busy.discard(upload_id)
+
+    def remove(self, upload_id):
+        for path in (self._meta_path(upload_id), self.part_path(upload_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def queued(self):
+        """Sessions handed to an upload job that has not finished yet"""
+        sessions = []
+        for entry in os.listdir(self.root):
+            upload_id, ext = os.path.splitext(entry)
+            if ext != ".json":
+                continue
+            session = self.get(upload_id)
+            if session and session.get("queued"):
+                sessions.append(session)
+        return sorted(sessions, key=lambda session: session["updated_at"])
+
+    def expire(self):
+        """Remove sessions idle for longer than ttl; returns their ids"""
+        cutoff = time.time() - self.ttl
+        expired = []
+        for entry in os.listdir(self.root):
+            upload_id, ext = os.path.splitext(entry)
+            if upload_id in self.busy:
+                continue
+            if ext == ".part" and not os.path.exists(self._meta_path(upload_id)):
+                # Left behind by a crash between creating the two files, or
+                # already removed with its session above
+                try:
+                    if os.path.getmtime(self.part_path(upload_id)) < cutoff:
+                        self.remove(upload_id)
+                except FileNotFoundError:
+                    pass
+                continue
+            if ext != ".json":
+                continue
+            session = self.get(upload_id)
+            if session is None or session["updated_at"] < cutoff:
+                self.remove(upload_id)
+                expired.append(upload_id)
+        return expired